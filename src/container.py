@@ -0,0 +1,225 @@
+"""Ingest and fixity check the members of ZIP and TAR containers without extracting them"""
+
+import hashlib
+import logging
+import os
+import tarfile
+import uuid
+import zipfile
+import zlib
+from datetime import datetime
+
+import db_classes
+import ingest
+import pronom
+
+# PRONOM keys of the archive formats whose members are ingested: ZIP, TAR and GZIP (for compressed TAR)
+CONTAINER_KEYS = ["x-fmt/263", "x-fmt/265", "x-fmt/266"]
+
+MEMBER_LOCATION_TYPE = "archive member"
+FLUSH_INTERVAL = 1000  # members ingested between session flushes
+# encrypted ZIP members raise RuntimeError, unsupported compression methods NotImplementedError
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError, OSError, RuntimeError,
+                  NotImplementedError)
+
+
+def is_container(file_object):
+    if file_object.formatRegistryKey not in CONTAINER_KEYS:
+        return False
+    path = file_object.contentLocationValue
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def member_location(container_path, member_name):
+    return "{}!{}".format(container_path, member_name)
+
+
+def members(path):
+    """Yield (name, stream) for each regular file in a ZIP or TAR archive, reading the archive front to back"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.header_offset):
+                if not info.is_dir():
+                    with archive.open(info) as stream:
+                        yield info.filename, stream
+    else:
+        # stream mode never seeks backwards, even for compressed archives
+        with tarfile.open(path, "r|*") as archive:
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info)
+
+
+def digest_stream(stream):
+    """Return the SHA256 digest and size of a stream, and the head and tail windows used for identification"""
+    buffer_size = 1048576
+    window = pronom.WINDOW_SIZE
+
+    sha256 = hashlib.sha256()
+    size = 0
+    head = b""
+    tail = b""
+    while True:
+        data = stream.read(buffer_size)
+        if not data:
+            break
+        sha256.update(data)
+        size += len(data)
+        if len(head) < window:
+            head += data[:window - len(head)]
+        tail = data[-window:] if len(data) >= window else (tail + data)[-window:]
+
+    if size <= window:
+        tail = head
+    return sha256.hexdigest(), size, head, tail
+
+
+def ingest_members(file_object, db_session, identifier=None):
+    """Create a PremisObject for every member of a container file, hashing each one as it is read"""
+    if not is_container(file_object):
+        return
+
+    logger = logging.getLogger(__name__)
+    container_path = file_object.contentLocationValue
+    logger.info('beginning member ingest of %s', container_path)
+    if identifier is None:
+        logger.warning("members of %s are not format identified: identifying archive members needs a DROID "
+                       "signature file (see 'pyDPres configure')", container_path)
+
+    # members refer to the container by id rather than through related_objects, so that they need not be
+    # held in memory until the ingest is committed
+    db_session.flush()
+
+    seen = set()
+    count = 0
+    try:
+        for name, stream in members(container_path):
+            count += ingest_member(file_object, db_session, identifier, name, stream, seen)
+            if count % FLUSH_INTERVAL == 0:
+                db_session.flush()
+    except ARCHIVE_ERRORS as error:
+        logger.error("member ingest of %s stopped after %d members: %s", container_path, count, error)
+
+    if count:
+        file_object.relationshipType = "structural"
+        file_object.relationshipSubType = "has Part"
+    logger.info('ingested %d members of %s', count, container_path)
+
+
+def ingest_member(file_object, db_session, identifier, name, stream, seen):
+    """Ingest one container member; return 1 if it was ingested, 0 if it was skipped"""
+    logger = logging.getLogger(__name__)
+    container_path = file_object.contentLocationValue
+
+    location = member_location(container_path, name)
+    if location in seen:
+        logger.warning("%s contains more than one member named %s; only the first is ingested",
+                       container_path, name)
+        return 0
+    seen.add(location)
+
+    digest, size, head, tail = digest_stream(stream)
+
+    member_object = db_classes.PremisObject(
+        objectIdentifierType="UUID",
+        objectIdentifierValue=str(uuid.uuid4()),
+        objectCategory="file",
+        messageDigestAlgorithm="SHA256",
+        messageDigest=digest,
+        file_size=size,
+        originalName=os.path.basename(name),
+        contentLocationType=MEMBER_LOCATION_TYPE,
+        contentLocationValue=location,
+        relationshipType="structural",
+        relationshipSubType="is Part Of",
+        relatedObject_id=file_object.object_id,
+        ingest_id=file_object.ingest_id
+    )
+
+    events = [
+        db_classes.PremisEvent(
+            eventIdentifierType="UUID",
+            eventIdentifierValue=str(uuid.uuid4()),
+            eventType="ingestion",
+            eventDateTime=datetime.now()
+        ),
+        db_classes.PremisEvent(
+            eventIdentifierType="UUID",
+            eventIdentifierValue=str(uuid.uuid4()),
+            eventType="message digest calculation",
+            eventDateTime=datetime.now()
+        )
+    ]
+
+    if identifier is not None:
+        member_format = ingest.DetermineFormat(name, identifier, (head, tail))
+        member_object.formatName = member_format.format_name
+        member_object.formatRegistryName = "PRONOM"
+        member_object.formatRegistryKey = member_format.format_registry_key
+        events.append(member_format.event)
+
+    member_object.events = events
+    db_session.add(member_object)
+    return 1
+
+
+def archive_members(container_object):
+    return [member for member in container_object.related_objects
+            if member.contentLocationType == MEMBER_LOCATION_TYPE]
+
+
+def member_fixity_event(outcome, detail):
+    return db_classes.PremisEvent(
+        eventIdentifierType="UUID",
+        eventIdentifierValue=str(uuid.uuid4()),
+        eventType="fixity check",
+        eventDateTime=datetime.now(),
+        eventDetail=detail,
+        eventOutcome=outcome
+    )
+
+
+def record_members_verified(container_object):
+    """
+    Record an OK fixity check on every member of a container whose own fixity check passed.
+
+    As long as the container's digest is unchanged, so is every member's, so the archive is not read again.
+    """
+    for member in archive_members(container_object):
+        member.events.append(member_fixity_event("OK", "verified through container digest"))
+
+
+def check_members(container_object):
+    """
+    Fixity check every member of a container in a single pass over the archive.
+
+    Only needed when the container itself failed its fixity check; otherwise `record_members_verified`
+    records the members as verified.
+    """
+    expected = {member.contentLocationValue: member for member in archive_members(container_object)}
+    if not expected:
+        return
+
+    logger = logging.getLogger(__name__)
+    container_path = container_object.contentLocationValue
+    outcomes = {}
+
+    try:
+        for name, stream in members(container_path):
+            location = member_location(container_path, name)
+            member = expected.get(location)
+            if member is None or location in outcomes:
+                continue
+            digest, _, _, _ = digest_stream(stream)
+            outcomes[location] = "OK" if digest == member.messageDigest else "Failed"
+        unread = "Missing"
+    except ARCHIVE_ERRORS as error:
+        logger.warning("could not read all members of %s: %s", container_path, error)
+        unread = "Failed"
+
+    for location, member in expected.items():
+        outcome = outcomes.get(location, unread)
+        if outcome != "OK":
+            logger.warning("{} fixity check: {}".format(location, outcome))
+
+        member.events.append(member_fixity_event(outcome, "verified in place within container"))
@@ -1,10 +1,86 @@
+import uuid
+from datetime import datetime, timedelta
+
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, ForeignKey, LargeBinary, Index
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import relationship
 
 
 Base = declarative_base()
 
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class HexDigest(TypeDecorator):
+    """A hex-encoded message digest, stored as raw bytes"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else bytes.fromhex(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else bytes(value).hex()
+
+
+class UUIDBytes(TypeDecorator):
+    """A UUID string, stored as its 16-byte binary form"""
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else uuid.UUID(value).bytes
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else str(uuid.UUID(bytes=bytes(value)))
+
+
+class EpochDateTime(TypeDecorator):
+    """A naive datetime, stored as integer microseconds since 1970-01-01"""
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else (value - EPOCH) // MICROSECOND
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else EPOCH + value * MICROSECOND
+
+
+class Vocabulary(TypeDecorator):
+    """
+    A string from a fixed vocabulary, stored as a small integer code.
+
+    Codes are positions in the term list, so new terms may only ever be appended.
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, *terms):
+        super().__init__()
+        self.terms = terms
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return self.terms.index(value) + 1
+        except ValueError:
+            raise ValueError("'{}' is not a recognized vocabulary term".format(value))
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else self.terms[value - 1]
+
+
+IdentifierType = Vocabulary("UUID")
+EventType = Vocabulary("ingestion", "message digest calculation", "format identification", "fixity check",
+                       "modification", "deletion")
+EventOutcome = Vocabulary("OK", "Failed", "Missing", "signature", "container", "extension", "fail")
+ObjectCategory = Vocabulary("file", "bitstream")
+DigestAlgorithm = Vocabulary("SHA256", "MD5")
+
 
 class PremisAgent(Base):
     __tablename__ = 'premis_agent'
@@ -21,28 +97,34 @@ class PremisEvent(Base):
     __tablename__ = 'premis_event'
 
     event_id = Column(Integer, nullable=False, primary_key=True)
-    eventIdentifierType = Column(String, nullable=False)
-    eventIdentifierValue = Column(String, nullable=False)
-    eventType = Column(String, nullable=False)
-    eventDateTime = Column(DateTime, nullable=False)
+    eventIdentifierType = Column(IdentifierType, nullable=False)
+    eventIdentifierValue = Column(UUIDBytes, nullable=False)
+    eventType = Column(EventType, nullable=False)
+    eventDateTime = Column(EpochDateTime, nullable=False)
     eventDetail = Column(String)
-    eventOutcome = Column(String)
+    eventOutcome = Column(EventOutcome)
     object_id = Column(Integer, ForeignKey("premis_object.object_id"))
     agent_id = Column(Integer, ForeignKey("premis_agent.agent_id"))
 
     premis_object = relationship("PremisObject", back_populates="events")
 
+    # finding the objects due for a fixity check reads each object's latest ingestion or fixity event; the
+    # leading object_id column also serves lookups of an object's events
+    __table_args__ = (
+        Index("ix_premis_event_object_type_time", "object_id", "eventType", "eventDateTime"),
+    )
+
 
 class PremisObject(Base):
     __tablename__ = 'premis_object'
 
     object_id = Column(Integer, primary_key=True)
-    objectIdentifierType = Column(String, nullable=False)
-    objectIdentifierValue = Column(String, nullable=False)
-    objectCategory = Column(String, nullable=False)
-    messageDigestAlgorithm = Column(String, nullable=False)
-    messageDigest = Column(String, nullable=False)
-    file_size = Column(String)
+    objectIdentifierType = Column(IdentifierType, nullable=False)
+    objectIdentifierValue = Column(UUIDBytes, nullable=False)
+    objectCategory = Column(ObjectCategory, nullable=False)
+    messageDigestAlgorithm = Column(DigestAlgorithm, nullable=False)
+    messageDigest = Column(HexDigest, nullable=False)
+    file_size = Column(BigInteger)
     formatName = Column(String)
     formatRegistryName = Column(String)
     formatRegistryKey = Column(String)
@@ -51,8 +133,10 @@ class PremisObject(Base):
     contentLocationValue = Column(String, unique=True)
     relationshipType = Column(String)
     relationshipSubType = Column(String)
-    relatedObject_id = Column(Integer, ForeignKey("premis_object.object_id"))
+    relatedObject_id = Column(Integer, ForeignKey("premis_object.object_id"), index=True)
     ingest_id = Column(Integer, ForeignKey("pyDPres_ingest.ingest_id"))
+    lease_owner = Column(String)
+    lease_expiry = Column(EpochDateTime)
 
     events = relationship("PremisEvent", back_populates="premis_object")
     properties = relationship('PremisSignificantProperties', back_populates="premis_object")
@@ -64,7 +148,7 @@ class PremisSignificantProperties(Base):
     __tablename__ = "premis_significant_properties"
 
     significant_properties_id = Column(Integer, nullable=False, primary_key=True)
-    object_id = Column(Integer, ForeignKey("premis_object.object_id"), nullable=False)
+    object_id = Column(Integer, ForeignKey("premis_object.object_id"), nullable=False, index=True)
     significantPropertiesType = Column(String, nullable=False)
     significantPropertiesValue = Column(String, nullable=False)
 
@@ -75,8 +159,8 @@ class PyDPresIngest(Base):
     __tablename__ = "pyDPres_ingest"
 
     ingest_id = Column(Integer, nullable=False, primary_key=True)
-    ingest_start_time = Column(DateTime, nullable=False)
-    ingest_end_time = Column(DateTime)
+    ingest_start_time = Column(EpochDateTime, nullable=False)
+    ingest_end_time = Column(EpochDateTime)
     ingest_note = Column(String)
 
     premis_objects = relationship("PremisObject", back_populates="ingest")
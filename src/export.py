@@ -0,0 +1,251 @@
+"""Stream the preservation metadata in the database out as a PREMIS 3 XML document"""
+
+import logging
+from xml.sax.saxutils import XMLGenerator
+
+import sqlalchemy as sqla
+from sqlalchemy.orm import aliased
+
+import db_classes
+
+PREMIS_NAMESPACE = "http://www.loc.gov/premis/v3"
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+PREMIS_SCHEMA = "http://www.loc.gov/standards/premis/v3/premis.xsd"
+
+
+class PremisWriter:
+    """
+    Incremental PREMIS XML writer.
+
+    Each element is written to the output as soon as it is complete, so memory use does not depend on
+    the size of the document.
+    """
+
+    def __init__(self, out):
+        self.xml = XMLGenerator(out, encoding="utf-8", short_empty_elements=True)
+
+    def start(self, name, attributes=None):
+        self.xml.startElement("premis:" + name, attributes or {})
+
+    def end(self, name):
+        self.xml.endElement("premis:" + name)
+
+    def element(self, name, value):
+        if value is None:
+            return
+        self.start(name)
+        self.xml.characters(str(value))
+        self.end(name)
+
+    def identifier(self, name, identifier_type, identifier_value):
+        self.start(name)
+        self.element(name + "Type", identifier_type)
+        self.element(name + "Value", identifier_value)
+        self.end(name)
+
+    def start_document(self):
+        self.xml.startDocument()
+        self.start("premis", {
+            "xmlns:premis": PREMIS_NAMESPACE,
+            "xmlns:xsi": XSI_NAMESPACE,
+            "xsi:schemaLocation": "{} {}".format(PREMIS_NAMESPACE, PREMIS_SCHEMA),
+            "version": "3.0",
+        })
+        self.xml.ignorableWhitespace("\n")
+
+    def end_document(self):
+        self.end("premis")
+        self.xml.ignorableWhitespace("\n")
+        self.xml.endDocument()
+
+    def write_object(self, premis_object, properties, related_identifiers):
+        self.start("object", {"xsi:type": "premis:" + premis_object.objectCategory})
+        self.identifier("objectIdentifier", premis_object.objectIdentifierType, premis_object.objectIdentifierValue)
+
+        for significant_property in properties:
+            self.start("significantProperties")
+            self.element("significantPropertiesType", significant_property.significantPropertiesType)
+            self.element("significantPropertiesValue", significant_property.significantPropertiesValue)
+            self.end("significantProperties")
+
+        self.start("objectCharacteristics")
+        self.element("compositionLevel", 0)
+        self.start("fixity")
+        self.element("messageDigestAlgorithm", premis_object.messageDigestAlgorithm)
+        self.element("messageDigest", premis_object.messageDigest)
+        self.end("fixity")
+        self.element("size", premis_object.file_size)
+        if premis_object.formatName or premis_object.formatRegistryKey:
+            self.start("format")
+            if premis_object.formatName:
+                self.start("formatDesignation")
+                self.element("formatName", premis_object.formatName)
+                self.end("formatDesignation")
+            if premis_object.formatRegistryKey:
+                self.start("formatRegistry")
+                self.element("formatRegistryName", premis_object.formatRegistryName)
+                self.element("formatRegistryKey", premis_object.formatRegistryKey)
+                self.end("formatRegistry")
+            self.end("format")
+        self.end("objectCharacteristics")
+
+        self.element("originalName", premis_object.originalName)
+
+        if premis_object.contentLocationValue:
+            self.start("storage")
+            self.start("contentLocation")
+            self.element("contentLocationType", premis_object.contentLocationType)
+            self.element("contentLocationValue", premis_object.contentLocationValue)
+            self.end("contentLocation")
+            self.end("storage")
+
+        if premis_object.relationshipType and related_identifiers:
+            self.start("relationship")
+            self.element("relationshipType", premis_object.relationshipType)
+            self.element("relationshipSubType", premis_object.relationshipSubType)
+            for identifier_type, identifier_value in related_identifiers:
+                self.identifier("relatedObjectIdentifier", identifier_type, identifier_value)
+            self.end("relationship")
+
+        self.end("object")
+        self.xml.ignorableWhitespace("\n")
+
+    def write_event(self, event, object_identifier, agent_identifier):
+        self.start("event")
+        self.identifier("eventIdentifier", event.eventIdentifierType, event.eventIdentifierValue)
+        self.element("eventType", event.eventType)
+        self.element("eventDateTime", event.eventDateTime.isoformat())
+        if event.eventDetail:
+            self.start("eventDetailInformation")
+            self.element("eventDetail", event.eventDetail)
+            self.end("eventDetailInformation")
+        if event.eventOutcome:
+            self.start("eventOutcomeInformation")
+            self.element("eventOutcome", event.eventOutcome)
+            self.end("eventOutcomeInformation")
+        if agent_identifier[1] is not None:
+            self.identifier("linkingAgentIdentifier", *agent_identifier)
+        if object_identifier[1] is not None:
+            self.identifier("linkingObjectIdentifier", *object_identifier)
+        self.end("event")
+        self.xml.ignorableWhitespace("\n")
+
+    def write_agent(self, agent):
+        self.start("agent")
+        self.identifier("agentIdentifier", agent.agentIdentifierType, agent.agentIdentifierValue)
+        self.element("agentName", agent.agentName)
+        self.element("agentType", agent.agentType)
+        self.element("agentVersion", agent.agentVersion)
+        self.end("agent")
+        self.xml.ignorableWhitespace("\n")
+
+
+def object_partition(ingest_id=None, object_range=None):
+    """Return a filter selecting the objects to export, or None to export everything"""
+    PremisObject = db_classes.PremisObject
+    conditions = []
+
+    if ingest_id is not None:
+        # bitstreams are exported along with the file they are part of
+        parent = aliased(PremisObject)
+        conditions.append(sqla.or_(
+            PremisObject.ingest_id == ingest_id,
+            PremisObject.relatedObject_id.in_(
+                sqla.select(parent.object_id).where(parent.ingest_id == ingest_id))
+        ))
+    if object_range is not None:
+        first, last = object_range
+        conditions.append(PremisObject.object_id.between(first, last))
+
+    return sqla.and_(*conditions) if conditions else None
+
+
+def in_batches(query, key, key_of, batch_size, db_session):
+    """
+    Yield the results of a query in order of `key`, `batch_size` rows at a time.
+
+    `key_of` extracts the key value from a result row. The session is cleared between batches so that
+    objects already written do not accumulate in its identity map.
+    """
+    last_key = None
+    while True:
+        batch_query = query if last_key is None else query.filter(key > last_key)
+        batch = batch_query.order_by(key).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last_key = key_of(batch[-1])
+        db_session.expunge_all()
+
+
+def export_premis(db_session, out, ingest_id=None, object_range=None, batch_size=1000):
+    """Write a PREMIS document for the selected objects, their events, and all agents to the stream `out`"""
+    logger = logging.getLogger(__name__)
+    PremisObject = db_classes.PremisObject
+    PremisEvent = db_classes.PremisEvent
+    PremisAgent = db_classes.PremisAgent
+    Properties = db_classes.PremisSignificantProperties
+
+    partition = object_partition(ingest_id, object_range)
+    writer = PremisWriter(out)
+    writer.start_document()
+
+    objects = db_session.query(PremisObject)
+    if partition is not None:
+        objects = objects.filter(partition)
+
+    object_count = 0
+    for batch in in_batches(objects, PremisObject.object_id, lambda row: row.object_id, batch_size,
+                            db_session):
+        object_ids = [premis_object.object_id for premis_object in batch]
+
+        properties = {}
+        for significant_property in db_session.query(Properties).\
+                filter(Properties.object_id.in_(object_ids)).\
+                order_by(Properties.significant_properties_id):
+            properties.setdefault(significant_property.object_id, []).append(significant_property)
+
+        # related objects may be a parent (relatedObject_id) or children pointing back at this object
+        related = {}
+        parent_ids = {premis_object.relatedObject_id for premis_object in batch if premis_object.relatedObject_id}
+        parent_identifiers = dict(
+            (object_id, (identifier_type, identifier_value)) for object_id, identifier_type, identifier_value in
+            db_session.query(PremisObject.object_id, PremisObject.objectIdentifierType,
+                             PremisObject.objectIdentifierValue).
+            filter(PremisObject.object_id.in_(parent_ids)))
+        for premis_object in batch:
+            if premis_object.relatedObject_id in parent_identifiers:
+                related.setdefault(premis_object.object_id, []).append(
+                    parent_identifiers[premis_object.relatedObject_id])
+        for parent_id, identifier_type, identifier_value in \
+                db_session.query(PremisObject.relatedObject_id, PremisObject.objectIdentifierType,
+                                 PremisObject.objectIdentifierValue).\
+                filter(PremisObject.relatedObject_id.in_(object_ids)).\
+                order_by(PremisObject.object_id):
+            related.setdefault(parent_id, []).append((identifier_type, identifier_value))
+
+        for premis_object in batch:
+            writer.write_object(premis_object, properties.get(premis_object.object_id, []),
+                                related.get(premis_object.object_id, []))
+        object_count += len(batch)
+
+    events = db_session.query(PremisEvent, PremisObject.objectIdentifierType, PremisObject.objectIdentifierValue,
+                              PremisAgent.agentIdentifierType, PremisAgent.agentIdentifierValue).\
+        outerjoin(PremisObject, PremisEvent.object_id == PremisObject.object_id).\
+        outerjoin(PremisAgent, PremisEvent.agent_id == PremisAgent.agent_id)
+    if partition is not None:
+        events = events.filter(partition)
+
+    event_count = 0
+    for batch in in_batches(events, PremisEvent.event_id, lambda row: row[0].event_id, batch_size, db_session):
+        for event, object_type, object_value, agent_type, agent_value in batch:
+            writer.write_event(event, (object_type, object_value), (agent_type, agent_value))
+        event_count += len(batch)
+
+    agents = db_session.query(PremisAgent)
+    for batch in in_batches(agents, PremisAgent.agent_id, lambda row: row.agent_id, batch_size, db_session):
+        for agent in batch:
+            writer.write_agent(agent)
+
+    writer.end_document()
+    logger.info("exported %d objects and %d events", object_count, event_count)
@@ -1,22 +1,30 @@
 import logging
+import os
+import socket
 import uuid
 from datetime import datetime
 
+import sqlalchemy as sqla
+
 import db_classes
 import ingest
 import format_specific
+import container
 
 
-def check_object_fixity(premis_object):
+def check_object_fixity(premis_object, direct_io=False):
     logger = logging.getLogger(__name__)
     file = premis_object.contentLocationValue
     logger.debug("start fixity check of {}".format(file))
 
     try:
-        new_hash = ingest.calculate_sha256(file)
+        new_hash = ingest.calculate_sha256(file, direct_io)
         if new_hash == premis_object.messageDigest:
             outcome = "OK"
             logger.debug("{} fixity verified".format(file))
+
+            # an unchanged container implies unchanged members
+            container.record_members_verified(premis_object)
         else:
             outcome = "Failed"
             logger.warning("{} fixity check failed".format(file))
@@ -28,6 +36,9 @@ def check_object_fixity(premis_object):
                 item = getattr(format_specific, i)
                 if callable(item) and i.startswith("fixity_"):
                     item(premis_object)
+
+            # find out which container members, if any, were affected
+            container.check_members(premis_object)
     except FileNotFoundError:
         logger.warning("{} is missing".format(file))
         outcome = "Missing"
@@ -41,4 +52,140 @@ def check_object_fixity(premis_object):
     )
     fixity_event.premis_object = premis_object
 
-    return premis_object
+    return fixity_event
+
+
+def standalone_files():
+    """Filter for file objects that are checked on their own; files inside a container are checked through it"""
+    PremisObject = db_classes.PremisObject
+    return sqla.and_(PremisObject.objectCategory == "file", PremisObject.relatedObject_id.is_(None))
+
+
+def physical_order(premis_objects):
+    """
+    Sort file objects by device and inode number.
+
+    Inode order approximates on-disk order on most file systems, so checking files this way keeps reads
+    sequential on spinning disks and finishes one device before moving to the next. Missing files go last.
+    """
+    def location(premis_object):
+        try:
+            stat = os.stat(premis_object.contentLocationValue)
+        except OSError:
+            return 1, 0, 0
+        return 0, stat.st_dev, stat.st_ino
+
+    return sorted(premis_objects, key=location)
+
+
+def worker_name():
+    return "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+def claim_fixity_batch(db_session, worker, datetime_cutoff, batch_size, lease_duration):
+    """
+    Lease up to `batch_size` file objects that are due for a fixity check to `worker`.
+
+    Returns the leased objects, which may be an empty list if other workers won every candidate, or None
+    if nothing is left to check.
+
+    Objects whose lease has expired are free to be claimed again. The claim is a single conditional UPDATE
+    that re-checks both the lease and the due date, so concurrent workers sharing the database never hold
+    the same object, nor check one that another worker verified since the candidates were selected.
+    """
+    PremisObject = db_classes.PremisObject
+    PremisEvent = db_classes.PremisEvent
+
+    now = datetime.now()
+    lease_is_free = sqla.or_(PremisObject.lease_expiry.is_(None), PremisObject.lease_expiry < now)
+    checked_recently = sqla.exists().\
+        where(PremisEvent.object_id == PremisObject.object_id).\
+        where(PremisEvent.eventType.in_(["ingestion", "fixity check"])).\
+        where(PremisEvent.eventDateTime >= datetime_cutoff)
+
+    last_checked = sqla.func.max(PremisEvent.eventDateTime)
+    candidate_ids = [object_id for object_id, in db_session.query(PremisObject.object_id).
+                     join(PremisEvent).
+                     filter(sqla.or_(PremisEvent.eventType == "ingestion", PremisEvent.eventType == "fixity check")).
+                     filter(standalone_files()).
+                     filter(lease_is_free).
+                     group_by(PremisObject.object_id).
+                     having(last_checked < datetime_cutoff).
+                     order_by(last_checked).
+                     limit(batch_size)]
+    if not candidate_ids:
+        return None
+
+    lease_expiry = now + lease_duration
+    db_session.query(PremisObject).\
+        filter(PremisObject.object_id.in_(candidate_ids)).\
+        filter(lease_is_free).\
+        filter(~checked_recently).\
+        update({PremisObject.lease_owner: worker, PremisObject.lease_expiry: lease_expiry},
+               synchronize_session=False)
+    db_session.commit()
+
+    return db_session.query(PremisObject).\
+        filter(PremisObject.lease_owner == worker).\
+        filter(PremisObject.lease_expiry == lease_expiry).\
+        order_by(PremisObject.object_id).\
+        all()
+
+
+def renew_lease(db_session, premis_object, worker, lease_duration):
+    """
+    Extend `worker`'s lease on an object just before checking it.
+
+    Returns False if the lease has passed to another worker in the meantime, in which case the object
+    must be left to that worker.
+    """
+    PremisObject = db_classes.PremisObject
+    renewed = db_session.query(PremisObject).\
+        filter(PremisObject.object_id == premis_object.object_id).\
+        filter(PremisObject.lease_owner == worker).\
+        update({PremisObject.lease_expiry: datetime.now() + lease_duration}, synchronize_session=False)
+    db_session.commit()
+    return renewed == 1
+
+
+def release_lease(db_session, premis_object, worker):
+    """Give up `worker`'s lease on an object; returns False if another worker holds it by now"""
+    PremisObject = db_classes.PremisObject
+    released = db_session.query(PremisObject).\
+        filter(PremisObject.object_id == premis_object.object_id).\
+        filter(PremisObject.lease_owner == worker).\
+        update({PremisObject.lease_owner: None, PremisObject.lease_expiry: None}, synchronize_session=False)
+    return released == 1
+
+
+def run_worker(db_session, worker, datetime_cutoff, batch_size, lease_duration, direct_io=False):
+    """
+    Check due objects batch by batch until none are left, sharing the work with any other workers.
+
+    Each object's lease is renewed right before it is checked, so `lease_duration` only needs to cover the
+    check of a single file. The fixity event and the release of the lease are committed together, and the
+    event is discarded if the lease expired and another worker took the object over during the check.
+    """
+    logger = logging.getLogger(__name__)
+    while True:
+        batch = claim_fixity_batch(db_session, worker, datetime_cutoff, batch_size, lease_duration)
+        if batch is None:
+            break
+        for premis_object in physical_order(batch):
+            if not renew_lease(db_session, premis_object, worker, lease_duration):
+                logger.debug("lease on {} was taken over by another worker".format(
+                    premis_object.contentLocationValue))
+                continue
+            try:
+                event = check_object_fixity(premis_object, direct_io)
+                db_session.add(event)
+                if release_lease(db_session, premis_object, worker):
+                    db_session.commit()
+                else:
+                    db_session.rollback()
+                    logger.warning("lease on {} expired during its fixity check; the check is left to the "
+                                   "worker that took it over".format(premis_object.contentLocationValue))
+            except:
+                db_session.rollback()
+                logger.error("got exception in fixity check of {}".format(premis_object.contentLocationValue))
+                raise
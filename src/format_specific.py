@@ -10,6 +10,11 @@ import logging
 import db_classes
 
 
+WAVE_FILE_KEYS = ["fmt/141", "fmt/143", "fmt/703", "fmt/704", "fmt/709", "fmt/712",
+                  "fmt/713", "fmt/6", "fmt/2", "fmt/1", "fmt/527", "fmt/705", "fmt/706",
+                  "fmt/707", "fmt/708", "fmt/710", "fmt/711"]
+
+
 def get_bwf_tech(file):
     tech_csv = subprocess.check_output(["bwfmetaedit", "--accept-nopadding",
                                         "--out-tech", "--MD5-Verify", file],
@@ -33,11 +38,7 @@ def get_bwf_core(file):
 
 
 def ingest_wave(file_object, session):
-    wave_file_keys = ["fmt/141", "fmt/143", "fmt/703", "fmt/704", "fmt/709", "fmt/712",
-                      "fmt/713", "fmt/6", "fmt/2", "fmt/1", "fmt/527", "fmt/705", "fmt/706",
-                      "fmt/707", "fmt/708", "fmt/710", "fmt/711"]
-
-    if file_object.formatRegistryKey not in wave_file_keys:
+    if file_object.formatRegistryKey not in WAVE_FILE_KEYS:
         return
 
     logger = logging.getLogger(__name__)
@@ -134,6 +135,9 @@ def ingest_wave(file_object, session):
 
 
 def fixity_wave(file_object):
+    if file_object.formatRegistryKey not in WAVE_FILE_KEYS or not file_object.related_objects:
+        return
+
     logger = logging.getLogger(__name__)
     file = file_object.contentLocationValue
 
@@ -152,7 +156,7 @@ def fixity_wave(file_object):
             event_outcome = "Failed"
         elif bwf_tech_md["Information"] == "MD5, no existing MD5 chunk":
             old_digest = related_bitstream.messageDigest
-            if old_digest == bwf_tech_md["MD5Generated"]:
+            if old_digest == bwf_tech_md["MD5Generated"].lower():
                 event_outcome = "OK"
             else:
                 event_outcome = "Failed"
@@ -168,7 +172,7 @@ def fixity_wave(file_object):
             eventDateTime=datetime.now()
         )
 
-        fixity_event.premis_object = related_bitstream
+        related_bitstream.events.append(fixity_event)
 
     else:
         logger.error("bitstream fixity check of {} failed: {}".format(file, bwf_tech_md["Errors"]))
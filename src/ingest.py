@@ -1,7 +1,10 @@
 """Perform ingest functions and create object record for file(s)"""
 
+import errno
 import hashlib
+import io
 import logging
+import mmap
 from datetime import datetime
 import uuid
 import subprocess
@@ -11,11 +14,20 @@ import os
 import sqlalchemy.exc
 
 import format_specific
+import container
 import db_classes
 
 
 class DetermineFormat:
-    def __init__(self, filename):
+    def __init__(self, filename, identifier=None, windows=None):
+        if identifier is not None:
+            if windows is None:
+                match = identifier.identify(filename)
+            else:
+                match = identifier.identify_bytes(*windows, filename)
+            self.record_match(match, identifier)
+            return
+
         fido_command = ["fido", "-matchprintf",
                         "OK\n%(info.puid)s\n%(info.formatname)s\n%(info.matchtype)s\n",
                         "-nomatchprintf",
@@ -42,18 +54,76 @@ class DetermineFormat:
             self.format_name = "unknown"
             self.format_registry_key = None
 
+    def record_match(self, match, identifier):
+        self.event = db_classes.PremisEvent(
+            eventIdentifierType="UUID",
+            eventIdentifierValue=str(uuid.uuid4()),
+            eventType="format identification",
+            eventDateTime=datetime.now(),
+            eventDetail="program=pyDPres; signatures=DROID_SignatureFile_V{}".format(identifier.version),
+            eventOutcome="fail" if match is None else match[2],
+        )
 
-def calculate_sha256(file):
-    buffer_size = 1048576
+        if match is not None:
+            self.format_registry_key, self.format_name, _ = match
+        else:
+            self.format_name = "unknown"
+            self.format_registry_key = None
+
+
+def open_for_hashing(file, direct_io):
+    """Open a file for one sequential pass, bypassing the page cache with O_DIRECT if asked and possible"""
+    flags = os.O_RDONLY | getattr(os, "O_BINARY", 0)  # O_BINARY: no newline translation on Windows
+    if direct_io and hasattr(os, "O_DIRECT"):
+        try:
+            return os.open(file, flags | os.O_DIRECT), True
+        except OSError as error:
+            if error.errno != errno.EINVAL:  # EINVAL: the file system does not support O_DIRECT
+                raise
+    return os.open(file, flags), False
+
+
+def read_into(fd, view):
+    """Read from `fd` straight into the buffer `view`, returning the number of bytes read"""
+    if hasattr(os, "readv"):
+        return os.readv(fd, [view])
+    # e.g. Windows, which has no readv
+    with io.FileIO(fd, "rb", closefd=False) as stream:
+        return stream.readinto(view)
+
+
+def calculate_sha256(file, direct_io=False):
+    """
+    Hash a file in one sequential pass without filling the page cache with it.
+
+    The kernel is told to read ahead aggressively, and pages are dropped as soon as they have been hashed so
+    that a full fixity run does not evict other programs' data. This drops every hashed page of the file,
+    including pages that were already cached before the check. With `direct_io`, reads bypass the page cache
+    altogether into a page-aligned buffer.
+    """
+    buffer_size = 4194304  # a multiple of any device block size, as O_DIRECT requires
 
     sha256 = hashlib.sha256()
+    can_fadvise = hasattr(os, "posix_fadvise")
 
-    with open(file, 'rb') as f:
-        while True:
-            data = f.read(buffer_size)
-            if not data:
-                break
-            sha256.update(data)
+    fd, direct = open_for_hashing(file, direct_io)
+    try:
+        if can_fadvise and not direct:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        # an anonymous mapping is page aligned, which satisfies O_DIRECT's buffer alignment
+        with mmap.mmap(-1, buffer_size) as buffer, memoryview(buffer) as view:
+            position = 0
+            while True:
+                length = read_into(fd, view)
+                if not length:
+                    break
+                sha256.update(view[:length])
+                if can_fadvise and not direct:
+                    os.posix_fadvise(fd, position, length, os.POSIX_FADV_DONTNEED)
+                position += length
+    finally:
+        os.close(fd)
 
     return sha256.hexdigest()
 
@@ -70,7 +140,7 @@ class Checksums:
         )
 
 
-def ingest_file(file, db_session, ingest_record, partition_type, update):
+def ingest_file(file, db_session, ingest_record, partition_type, update, identifier=None):
     logger = logging.getLogger(__name__)
 
     filepath = os.fspath(file)
@@ -95,7 +165,7 @@ def ingest_file(file, db_session, ingest_record, partition_type, update):
         raise DuplicateIngestError
 
     logger.info('beginning ingest of %s', filepath)
-    file_format = DetermineFormat(file)
+    file_format = DetermineFormat(file, identifier)
     checksums = Checksums(file)
 
     file_object.messageDigest = checksums.sha256
@@ -123,3 +193,5 @@ def ingest_file(file, db_session, ingest_record, partition_type, update):
         item = getattr(format_specific, i)
         if callable(item) and i.startswith("ingest_"):
             item(file_object, db_session)
+
+    container.ingest_members(file_object, db_session, identifier)
@@ -0,0 +1,170 @@
+"""Convert databases created by earlier versions of pyDPres to the current schema"""
+
+import logging
+
+import sqlalchemy as sqla
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData
+
+import db_classes
+from session import database_url
+
+
+legacy_metadata = MetaData()
+
+legacy_agent = Table(
+    "premis_agent", legacy_metadata,
+    Column("agent_id", Integer, primary_key=True),
+    Column("agentIdentifierType", String),
+    Column("agentIdentifierValue", String),
+    Column("agentName", String),
+    Column("agentType", String),
+    Column("agentVersion", String),
+)
+
+legacy_event = Table(
+    "premis_event", legacy_metadata,
+    Column("event_id", Integer, primary_key=True),
+    Column("eventIdentifierType", String),
+    Column("eventIdentifierValue", String),
+    Column("eventType", String),
+    Column("eventDateTime", DateTime),
+    Column("eventDetail", String),
+    Column("eventOutcome", String),
+    Column("object_id", Integer),
+    Column("agent_id", Integer),
+)
+
+legacy_object = Table(
+    "premis_object", legacy_metadata,
+    Column("object_id", Integer, primary_key=True),
+    Column("objectIdentifierType", String),
+    Column("objectIdentifierValue", String),
+    Column("objectCategory", String),
+    Column("messageDigestAlgorithm", String),
+    Column("messageDigest", String),
+    Column("file_size", String),
+    Column("formatName", String),
+    Column("formatRegistryName", String),
+    Column("formatRegistryKey", String),
+    Column("originalName", String),
+    Column("contentLocationType", String),
+    Column("contentLocationValue", String),
+    Column("relationshipType", String),
+    Column("relationshipSubType", String),
+    Column("relatedObject_id", Integer),
+    Column("ingest_id", Integer),
+)
+
+legacy_properties = Table(
+    "premis_significant_properties", legacy_metadata,
+    Column("significant_properties_id", Integer, primary_key=True),
+    Column("object_id", Integer),
+    Column("significantPropertiesType", String),
+    Column("significantPropertiesValue", String),
+)
+
+legacy_ingest = Table(
+    "pyDPres_ingest", legacy_metadata,
+    Column("ingest_id", Integer, primary_key=True),
+    Column("ingest_start_time", DateTime),
+    Column("ingest_end_time", DateTime),
+    Column("ingest_note", String),
+)
+
+legacy_info = Table(
+    "pyDPres_info", legacy_metadata,
+    Column("info_id", Integer, primary_key=True),
+    Column("info_name", String),
+    Column("info_value", String),
+)
+
+
+def convert_object(row):
+    if row["file_size"] is not None:
+        row["file_size"] = int(row["file_size"])
+    return row
+
+
+def convert_info(row):
+    # the target database already carries its own version record
+    if row["info_name"] == "version":
+        return None
+    del row["info_id"]
+    return row
+
+
+# parents before children, so that foreign keys always point at rows that have already been copied
+MIGRATION_STEPS = [
+    (legacy_agent, db_classes.PremisAgent, None),
+    (legacy_ingest, db_classes.PyDPresIngest, None),
+    (legacy_object, db_classes.PremisObject, convert_object),
+    (legacy_event, db_classes.PremisEvent, None),
+    (legacy_properties, db_classes.PremisSignificantProperties, None),
+    (legacy_info, db_classes.PyDPresInfo, convert_info),
+]
+
+
+def read_batches(connection, table, batch_size):
+    """Yield the rows of a table as lists of dicts, paging on the primary key"""
+    key, = table.primary_key.columns
+    last_key = None
+
+    while True:
+        query = table.select().order_by(key).limit(batch_size)
+        if last_key is not None:
+            query = query.where(key > last_key)
+        result = connection.execute(query)
+        columns = list(result.keys())
+        rows = [dict(zip(columns, row)) for row in result]
+        if not rows:
+            return
+        last_key = rows[-1][key.name]
+        yield rows
+
+
+def advance_sequence(connection, table):
+    """
+    Move the sequence behind a table's primary key past the largest key copied into it.
+
+    Rows are copied with their original keys, which bypasses the sequence on databases that use one (e.g.
+    PostgreSQL), so the next row inserted afterwards would otherwise reuse key 1.
+    """
+    key, = table.primary_key.columns
+    quoted_table = connection.dialect.identifier_preparer.format_table(table)
+    largest = sqla.func.max(key)
+    connection.execute(sqla.select(sqla.func.setval(
+        sqla.func.pg_get_serial_sequence(quoted_table, key.name),
+        sqla.func.coalesce(largest, 1),
+        largest.isnot(None))))
+
+
+def migrate_database(source_file, target_file, batch_size=5000):
+    """
+    Copy every record of a version 0.1 database into an empty version 0.2 database.
+
+    Rows are read in primary key order, `batch_size` at a time, and written through the current table
+    definitions so that digests, identifiers, vocabulary terms and timestamps are converted on the way in.
+    """
+    logger = logging.getLogger(__name__)
+
+    source_engine = sqla.create_engine(database_url(source_file))
+    target_engine = sqla.create_engine(database_url(target_file))
+
+    with source_engine.connect() as source:
+        for legacy_table, db_class, convert in MIGRATION_STEPS:
+            target_table = db_class.__table__
+            count = 0
+            for rows in read_batches(source, legacy_table, batch_size):
+                if convert is not None:
+                    rows = [row for row in map(convert, rows) if row is not None]
+                if rows:
+                    with target_engine.begin() as target:
+                        target.execute(target_table.insert(), rows)
+                count += len(rows)
+            if target_engine.dialect.name == "postgresql":
+                with target_engine.begin() as target:
+                    advance_sequence(target, target_table)
+            logger.info("migrated %d rows of %s", count, target_table.name)
+
+    source_engine.dispose()
+    target_engine.dispose()
@@ -0,0 +1,353 @@
+"""In-process PRONOM format identification from a DROID binary signature file"""
+
+import functools
+import logging
+import os
+import pickle
+import re
+import xml.etree.ElementTree as ElementTree
+
+CACHE_VERSION = 3
+CACHE_FILENAME = "pronom-signatures.pickle"
+WINDOW_SIZE = 131072  # bytes read from each end of a file, as for fido's default buffer
+PREFIX_LENGTH = 8  # longest literal prefix/suffix used as an index key
+
+
+class SignatureError(Exception):
+    pass
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def children(element, name):
+    return [child for child in element if local_name(child.tag) == name]
+
+
+def descendants(element, name):
+    return [child for child in element.iter() if local_name(child.tag) == name]
+
+
+def gap(minimum, maximum):
+    if maximum is not None and maximum < minimum:
+        # DROID treats a maximum below the minimum as equal to it; re would reject the quantifier
+        maximum = minimum
+    if maximum is None:
+        return b"" if minimum == 0 else b".{%d,}" % minimum
+    if minimum == maximum:
+        return b"" if minimum == 0 else b".{%d}" % minimum
+    return b".{%d,%d}" % (minimum, maximum)
+
+
+def offset(element, min_name, max_name):
+    minimum = int(element.get(min_name) or 0)
+    maximum = element.get(max_name)
+    return minimum, None if maximum in (None, "", "*") else int(maximum)
+
+
+def fixed_offset(minimum, maximum):
+    """Return the offset if a (minimum, maximum) pair allows only one, as `gap` reads it, or None"""
+    if maximum is not None and maximum <= minimum:
+        return minimum
+    return None
+
+
+def byte_class(text):
+    negate = text.startswith("!")
+    if negate:
+        text = text[1:]
+    if not re.fullmatch(r"[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2})?", text):
+        raise SignatureError("unsupported byte range [{}]".format(text))
+    low, _, high = text.partition(":")
+    low = re.escape(bytes.fromhex(low))
+    high = re.escape(bytes.fromhex(high)) if high else low
+    return b"[" + (b"^" if negate else b"") + low + b"-" + high + b"]"
+
+
+def parse_sequence(text):
+    """
+    Split a DROID byte sequence into tokens.
+
+    Each token is a ("literal", bytes) or ("pattern", regex) pair, so that callers can find the literal runs
+    usable as index keys as well as build the full regular expression.
+    """
+    text = "".join(text.split())
+    tokens = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if text.startswith("??", i):
+            tokens.append(("pattern", b"."))
+            i += 2
+        elif c == "*":
+            tokens.append(("pattern", b".*"))
+            i += 1
+        elif c == "{":
+            end = text.index("}", i)
+            minimum, _, maximum = text[i + 1:end].partition("-")
+            if not maximum:
+                maximum = minimum
+            tokens.append(("pattern", gap(int(minimum), None if maximum == "*" else int(maximum))))
+            i = end + 1
+        elif c == "[":
+            end = text.index("]", i)
+            tokens.append(("pattern", byte_class(text[i + 1:end])))
+            i = end + 1
+        elif c == "(":
+            end = text.index(")", i)
+            alternatives = [tokens_to_regex(parse_sequence(alt)) for alt in text[i + 1:end].split("|")]
+            tokens.append(("pattern", b"(?:" + b"|".join(alternatives) + b")"))
+            i = end + 1
+        else:
+            try:
+                tokens.append(("literal", bytes.fromhex(text[i:i + 2])))
+            except ValueError:
+                raise SignatureError("unsupported sequence syntax at '{}'".format(text[i:]))
+            i += 2
+    return tokens
+
+
+def tokens_to_regex(tokens):
+    return b"".join(re.escape(value) if kind == "literal" else value for kind, value in tokens)
+
+
+def literal_runs(tokens):
+    runs = [b""]
+    for kind, value in tokens:
+        if kind == "literal":
+            runs[-1] += value
+        else:
+            runs.append(b"")
+    return runs
+
+
+def fragments_to_regex(fragments, left):
+    """Join Left/RightFragments by position; fragments sharing a position are alternatives"""
+    by_position = {}
+    for fragment in fragments:
+        by_position.setdefault(int(fragment.get("Position")), []).append(fragment)
+
+    parts = []
+    for position in sorted(by_position, reverse=left):
+        alternatives = []
+        for fragment in by_position[position]:
+            fragment_regex = tokens_to_regex(parse_sequence(fragment.text or ""))
+            fragment_gap = gap(*offset(fragment, "MinOffset", "MaxOffset"))
+            alternatives.append(fragment_regex + fragment_gap if left else fragment_gap + fragment_regex)
+        parts.append(b"(?:" + b"|".join(alternatives) + b")")
+    return b"".join(parts)
+
+
+class ByteSequence:
+    """One anchored (BOF/EOF) or floating (Variable) byte sequence of an internal signature"""
+
+    def __init__(self, element):
+        reference = element.get("Reference") or "Variable"
+        self.anchor = "BOF" if reference.startswith("BOF") else "EOF" if reference.startswith("EOF") else "VAR"
+
+        subsequences = sorted(children(element, "SubSequence"), key=lambda s: int(s.get("Position")))
+        if not subsequences:
+            raise SignatureError("byte sequence has no subsequences")
+
+        parts = []
+        runs = []
+        for subsequence in subsequences:
+            sequence, = children(subsequence, "Sequence")
+            tokens = parse_sequence(sequence.text or "")
+            runs.append(literal_runs(tokens))
+            parts.append((subsequence, tokens_to_regex(tokens),
+                          children(subsequence, "LeftFragment"), children(subsequence, "RightFragment")))
+
+        # the literal run at the anchored end, usable as a key when it sits at a fixed distance from the
+        # beginning (BOF) or end (EOF) of the file; `key_offset` is that distance
+        self.key = b""
+        self.key_offset = 0
+        first, _, left, right = parts[0]
+        key_offset = fixed_offset(*offset(first, "SubSeqMinOffset", "SubSeqMaxOffset"))
+        if key_offset is not None:
+            if self.anchor == "BOF" and not left:
+                self.key = runs[0][0][:PREFIX_LENGTH]
+                self.key_offset = key_offset
+            elif self.anchor == "EOF" and not right:
+                self.key = runs[0][-1][-PREFIX_LENGTH:]
+                self.key_offset = key_offset
+        self.longest_literal = max((run for subsequence_runs in runs for run in subsequence_runs), key=len)
+
+        regex = b""
+        if self.anchor == "EOF":
+            # subsequence 1 is the one nearest the end of the file
+            for subsequence, sequence_regex, left, right in reversed(parts):
+                regex += fragments_to_regex(left, True) + sequence_regex + fragments_to_regex(right, False)
+                regex += gap(*offset(subsequence, "SubSeqMinOffset", "SubSeqMaxOffset"))
+            self.pattern = regex + b"\\Z"
+        else:
+            for index, (subsequence, sequence_regex, left, right) in enumerate(parts):
+                if self.anchor == "BOF" or index > 0:
+                    regex += gap(*offset(subsequence, "SubSeqMinOffset", "SubSeqMaxOffset"))
+                regex += fragments_to_regex(left, True) + sequence_regex + fragments_to_regex(right, False)
+            self.pattern = (b"\\A" if self.anchor == "BOF" else b"") + regex
+
+        # a pattern re rejects is found here, while the index is built, rather than during an ingest
+        compiled(self.pattern)
+
+    def matches(self, head, tail):
+        regex = compiled(self.pattern)
+        if self.anchor == "BOF":
+            return regex.search(head) is not None
+        if self.anchor == "EOF":
+            return regex.search(tail) is not None
+        return regex.search(head) is not None or (tail is not head and regex.search(tail) is not None)
+
+
+@functools.lru_cache(maxsize=None)
+def compiled(pattern):
+    # patterns are compiled once when the index is built; an index loaded from the cache compiles them again
+    # lazily, so that signatures which never become candidates cost nothing at startup
+    return re.compile(pattern, re.DOTALL)
+
+
+class FileFormat:
+    def __init__(self, element):
+        self.format_id = element.get("ID")
+        self.puid = element.get("PUID")
+        self.name = element.get("Name")
+        self.signature_ids = [e.text.strip() for e in children(element, "InternalSignatureID")]
+        self.extensions = [e.text.strip().lower() for e in children(element, "Extension")]
+        self.priority_over = {e.text.strip() for e in children(element, "HasPriorityOverFileFormatID")}
+
+
+class SignatureIndex:
+    """
+    Compiled index of the internal signatures in a DROID signature file.
+
+    Signatures with a literal byte run at a fixed offset from the beginning or end of a file (such as a
+    magic number at offset 0, or TAR's "ustar" at 257) are keyed on that run and its offset, so a file is
+    only tested against signatures whose bytes it has at that very position: one dictionary lookup per
+    distinct (offset, length) pair. Remaining signatures are keyed on their longest literal byte run and
+    only tested when that run is present in the file's head or tail window.
+    """
+
+    def __init__(self, signature_file):
+        try:
+            root = ElementTree.parse(signature_file).getroot()
+        except ElementTree.ParseError as error:
+            raise SignatureError("{} is not a valid signature file: {}".format(signature_file, error))
+        self.version = root.get("Version")
+        logger = logging.getLogger(__name__)
+
+        self.signatures = {}
+        for element in descendants(root, "InternalSignature"):
+            try:
+                self.signatures[element.get("ID")] = [ByteSequence(e) for e in children(element, "ByteSequence")]
+            except (SignatureError, ValueError, TypeError, re.error) as error:
+                logger.debug("skipping internal signature %s: %s", element.get("ID"), error)
+
+        self.formats = [FileFormat(e) for e in descendants(root, "FileFormat")]
+        self.formats_by_signature = {}
+        self.formats_by_extension = {}
+        for file_format in self.formats:
+            for signature_id in file_format.signature_ids:
+                self.formats_by_signature.setdefault(signature_id, []).append(file_format)
+            for extension in file_format.extensions:
+                self.formats_by_extension.setdefault(extension, []).append(file_format)
+
+        self.prefixes = {}
+        self.suffixes = {}
+        self.literals = []
+        self.unindexed = []
+        for signature_id, sequences in self.signatures.items():
+            if not sequences or signature_id not in self.formats_by_signature:
+                continue
+            bof_keys = [(s.key_offset, s.key) for s in sequences if s.anchor == "BOF" and s.key]
+            eof_keys = [(s.key_offset, s.key) for s in sequences if s.anchor == "EOF" and s.key]
+            literals = [s.longest_literal for s in sequences if s.longest_literal]
+            if bof_keys:
+                key_offset, key = max(bof_keys, key=lambda k: len(k[1]))
+                self.prefixes.setdefault((key_offset, len(key)), {}).setdefault(key, []).append(signature_id)
+            elif eof_keys:
+                key_offset, key = max(eof_keys, key=lambda k: len(k[1]))
+                self.suffixes.setdefault((key_offset, len(key)), {}).setdefault(key, []).append(signature_id)
+            elif literals:
+                self.literals.append((max(literals, key=len), signature_id))
+            else:
+                self.unindexed.append(signature_id)
+
+    @classmethod
+    def load(cls, signature_file, cache_dir):
+        """Load the index for `signature_file`, from the cache in `cache_dir` if it is still current"""
+        logger = logging.getLogger(__name__)
+        stat = os.stat(signature_file)
+        cache_key = (CACHE_VERSION, os.path.abspath(signature_file), stat.st_mtime_ns, stat.st_size)
+        cache_file = os.path.join(os.fspath(cache_dir), CACHE_FILENAME)
+
+        try:
+            with open(cache_file, "rb") as f:
+                cached_key, index = pickle.load(f)
+            if cached_key == cache_key:
+                return index
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+            pass
+
+        logger.info("compiling PRONOM signatures from %s", signature_file)
+        index = cls(signature_file)
+        try:
+            with open(cache_file, "wb") as f:
+                pickle.dump((cache_key, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            logger.warning("could not write signature cache %s", cache_file)
+        return index
+
+    def candidates(self, head, tail):
+        found = []
+        for (key_offset, length), keys in self.prefixes.items():
+            found.extend(keys.get(head[key_offset:key_offset + length], ()))
+        for (key_offset, length), keys in self.suffixes.items():
+            end = len(tail) - key_offset
+            if end >= length:
+                found.extend(keys.get(tail[end - length:end], ()))
+        for literal, signature_id in self.literals:
+            if literal in head or (tail is not head and literal in tail):
+                found.append(signature_id)
+        found.extend(self.unindexed)
+        return list(dict.fromkeys(found))
+
+    def identify(self, filename):
+        """Return (puid, format name, match type) for a file, or None if nothing matched"""
+        with open(filename, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read(WINDOW_SIZE)
+            if size <= WINDOW_SIZE:
+                tail = head
+            else:
+                f.seek(size - WINDOW_SIZE)
+                tail = f.read(WINDOW_SIZE)
+
+        return self.identify_bytes(head, tail, filename)
+
+    def identify_bytes(self, head, tail, filename):
+        """
+        Identify a file from its first and last WINDOW_SIZE bytes.
+
+        For files no longer than WINDOW_SIZE, `tail` should be the very same object as `head`.
+        """
+        extension = os.path.splitext(os.fspath(filename))[1].lstrip(".").lower()
+
+        matched = []
+        for signature_id in self.candidates(head, tail):
+            if all(sequence.matches(head, tail) for sequence in self.signatures[signature_id]):
+                for file_format in self.formats_by_signature[signature_id]:
+                    if file_format not in matched:
+                        matched.append(file_format)
+
+        if matched:
+            outranked = set().union(*(f.priority_over for f in matched))
+            matched = [f for f in matched if f.format_id not in outranked]
+            matched.sort(key=lambda f: extension not in f.extensions)
+            return matched[0].puid, matched[0].name, "signature"
+
+        by_extension = self.formats_by_extension.get(extension)
+        if by_extension:
+            return by_extension[0].puid, by_extension[0].name, "extension"
+
+        return None
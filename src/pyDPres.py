@@ -5,6 +5,8 @@ import logging
 from logging.config import dictConfig
 from session import *
 import subprocess
+import signal
+import gzip
 from datetime import datetime, timedelta
 
 import click
@@ -15,12 +17,35 @@ from sqlalchemy import exc
 from db_classes import *
 from ingest import *
 from fixity import *
+import migrate as migration
+import pronom
+import watch as watcher
+import export
 
-DB_VERSION = "0.1"
+DB_VERSION = "0.2"
+
+
+def load_identifier(context):
+    """Return the built-in format identifier if one is configured, or None after making sure fido is available"""
+    if context.obj["signature_file"]:
+        try:
+            return pronom.SignatureIndex.load(context.obj["signature_file"], context.obj["user_data_dir"])
+        except (OSError, pronom.SignatureError):
+            raise click.ClickException("Could not read DROID signature file {}.".format(context.obj["signature_file"]))
+
+    fido_command = ["fido", "-matchprintf",
+                    "OK\n%(info.puid)s\n%(info.formatname)s\n%(info.matchtype)s\n"]
+
+    try:
+        fido_out = subprocess.run(fido_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise click.ClickException("External program 'fido' not found. You will not be able to run ingests.")
+
+    return None
 
 
 def create_new_database(filename):
-    engine = sqla.create_engine("sqlite:///{}".format(filename))
+    engine = sqla.create_engine(database_url(filename))
     Session.configure(bind=engine)
     db_classes.Base.metadata.create_all(engine)
     session = Session()
@@ -31,7 +56,7 @@ def create_new_database(filename):
 
 
 @click.group()
-@click.option('--dbfile', help="specify the SQLite database file to use")
+@click.option('--dbfile', help="specify the SQLite database file, or an SQLAlchemy database URL, to use")
 @click.option('--quiet', is_flag=True, help='turn off logging to stderr')
 @click.pass_context
 def cli(context, dbfile, quiet):
@@ -39,7 +64,8 @@ def cli(context, dbfile, quiet):
     `pyDPres` is a tool for checksum/hash calculation, fixity checking, format identification, and
     generation of preservation metadata.  It can be run on the command line or as a cron job.
 
-    Preservation metadata are saved in a PREMIS-compliant sqlite file in a configurable location.
+    Preservation metadata are saved in a PREMIS-compliant sqlite file in a configurable location, or in
+    any database SQLAlchemy can connect to, given as a URL.
     Run `pyDPres configure` to set up.
     """
 
@@ -59,6 +85,7 @@ def cli(context, dbfile, quiet):
             context.obj["file_logging"] = True if config["DEFAULT"]["FILE_LOGGING"] == "True" else False
             context.obj["fixity_interval"] = config["DEFAULT"]["FIXITY_INTERVAL"]
             context.obj["partition_type"] = config["DEFAULT"]["PARTITION_TYPE"]
+            context.obj["signature_file"] = config["DEFAULT"].get("SIGNATURE_FILE", "")
             context.obj["has_config"] = True
         except (KeyError, configparser.Error):
             pass
@@ -109,19 +136,27 @@ def cli(context, dbfile, quiet):
         dictConfig(logging_config)
         logger = logging.getLogger(__name__)
 
+        if context.invoked_subcommand in ("migrate", "configure"):
+            # the database being migrated is, by definition, not yet at the current version, and configure
+            # must be able to replace a default database that is not
+            return
+
         if dbfile:
-            if not os.path.isfile(dbfile):
+            if not is_database_url(dbfile) and not os.path.isfile(dbfile):
                 click.echo("The specified file does not exist.")
                 click.confirm('Would you like to create it?', abort=True, default=True)
                 create_new_database(dbfile)
         else:
             dbfile = context.obj["config_dbfile"]
 
-        engine = sqla.create_engine("sqlite:///{}".format(dbfile))
+        engine = sqla.create_engine(database_url(dbfile))
         Session.configure(bind=engine)
         session = Session()
         try:
             db_version, = session.query(db_classes.PyDPresInfo.info_value).filter_by(info_name="version").one()
+            if db_version == "0.1":
+                raise click.ClickException("{} was created with an older version of pyDPres. "
+                                           "Run 'pyDPres migrate' to convert it.".format(dbfile))
             if db_version != DB_VERSION:
                 raise click.ClickException('{} was created with an incompatible version of pyDPres.'.format(dbfile))
         except (exc.OperationalError, exc.DatabaseError):
@@ -146,18 +181,37 @@ def configure(context):
 
     old_default_db = user_dir / "pyDPres.sqlite" if not context.obj["has_config"] \
         else context.obj["config_dbfile"]
-    default_db = click.prompt("\nSet default database", default=old_default_db)
+    default_db = click.prompt("\nSet default database (file path or SQLAlchemy URL)", default=old_default_db)
 
-    if not os.path.isfile(default_db):
+    if is_database_url(default_db):
+        # a database server is never dropped from here; an empty database gets the pyDPres tables
+        engine = sqla.create_engine(database_url(default_db))
+        Session.configure(bind=engine)
+        session = Session()
+        try:
+            db_version, = session.query(db_classes.PyDPresInfo.info_value).filter_by(info_name="version").one()
+        except (exc.OperationalError, exc.ProgrammingError, exc.NoResultFound):
+            session.close()
+            create_new_database(default_db)
+        else:
+            session.close()
+            if db_version != DB_VERSION:
+                raise click.ClickException('{} was created with an incompatible version of pyDPres.'
+                                           .format(default_db))
+    elif not os.path.isfile(default_db):
         # file is not there, so create it
         create_new_database(default_db)
     else:
         # file is there. check if it's valid, if not, confirm before delete and recreate
-        engine = sqla.create_engine("sqlite:///{}".format(default_db))
+        engine = sqla.create_engine(database_url(default_db))
         Session.configure(bind=engine)
         session = Session()
         try:
             db_version, = session.query(db_classes.PyDPresInfo.info_value).filter_by(info_name="version").one()
+            if db_version == "0.1":
+                session.close()
+                raise click.ClickException("{} was created with an older version of pyDPres. Run 'pyDPres migrate' "
+                                           "to convert it and choose the converted database here.".format(default_db))
             if db_version != DB_VERSION:
                 click.echo('\n{} was created with an incompatible version of pyDPres.'.format(default_db))
                 click.confirm('Would you like to delete it and generate a new, empty database?', abort=True)
@@ -182,12 +236,18 @@ def configure(context):
     click.echo("\npyDPres does not currently determine the disk partition type 'on the fly'.")
     partition_type = click.prompt("What is your disk partition type?", default=old_partition_type)
 
+    old_signature_file = "" if not context.obj["has_config"] else context.obj["signature_file"]
+    click.echo("\nFormat identification uses 'fido' unless a DROID signature file is given for the built-in matcher.")
+    signature_file = click.prompt("DROID signature file (leave empty to use fido)", default=old_signature_file,
+                                  show_default=False)
+
     config = configparser.ConfigParser()
     config['DEFAULT'] = {
         "DEFAULT_DB": os.fspath(default_db),
         "FILE_LOGGING": file_logging,
         "FIXITY_INTERVAL": fixity_interval,
-        "PARTITION_TYPE": partition_type
+        "PARTITION_TYPE": partition_type,
+        "SIGNATURE_FILE": signature_file
     }
     config_file = user_dir / "pyDPres-config.ini"
     with open(config_file, 'w') as configfile:
@@ -211,13 +271,7 @@ def ingest(context, paths, dry_run, stdin, note, update):
     if not context.obj["has_config"]:
         raise click.ClickException("Improper configuration detected. Run 'pyDPres configure' to set up.")
 
-    fido_command = ["fido", "-matchprintf",
-                    "OK\n%(info.puid)s\n%(info.formatname)s\n%(info.matchtype)s\n"]
-
-    try:
-        fido_out = subprocess.run(fido_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except FileNotFoundError:
-        raise click.ClickException("External program 'fido' not found. You will not be able to run ingests.")
+    identifier = load_identifier(context)
 
     logger = logging.getLogger(__name__)
     db_session = context.obj["db_session"]
@@ -243,7 +297,8 @@ def ingest(context, paths, dry_run, stdin, note, update):
                         click.echo(os.fspath(filepath))
                     else:
                         try:
-                            ingest_file(filepath, db_session, ingest_record, context.obj["partition_type"], update)
+                            ingest_file(filepath, db_session, ingest_record, context.obj["partition_type"], update,
+                                        identifier)
                             ingest_record.ingest_end_time = datetime.now()
                             db_session.commit()
                         except DuplicateIngestError:
@@ -257,16 +312,70 @@ def ingest(context, paths, dry_run, stdin, note, update):
     db_session.close()
 
 
+@cli.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--note', help="Optional description of the ingest record used for new files")
+@click.option('--debounce', type=float, default=2.0,
+              help="Seconds a file must be left alone before it is ingested or re-checked")
+@click.pass_context
+def watch(context, paths, note, debounce):
+    """
+    Ingest and fixity check files as they change (Linux only)
+    """
+    """
+    New files are ingested as soon as they are closed after writing or moved into a watched directory.
+    Changes to or deletion of files that are already ingested are recorded and followed by a fixity check.
+    """
+
+    if not context.obj["has_config"]:
+        raise click.ClickException("Improper configuration detected. Run 'pyDPres configure' to set up.")
+
+    identifier = load_identifier(context)
+
+    logger = logging.getLogger(__name__)
+    db_session = context.obj["db_session"]
+
+    ingest_record = db_classes.PyDPresIngest(ingest_start_time=datetime.now(), ingest_note=note or "watch")
+    db_session.add(ingest_record)
+    db_session.commit()
+
+    try:
+        file_watcher = watcher.Watcher(db_session, ingest_record, context.obj["partition_type"], identifier, debounce)
+    except (OSError, AttributeError):
+        raise click.ClickException("inotify is not available. 'pyDPres watch' only runs on Linux.")
+
+    # Ctrl-C and a service manager's SIGTERM both let the current batch finish before the watch stops
+    signal.signal(signal.SIGINT, file_watcher.stop)
+    signal.signal(signal.SIGTERM, file_watcher.stop)
+
+    try:
+        file_watcher.run(paths)
+    except:
+        db_session.rollback()
+        db_session.close()
+        logger.error("watch stopped by an exception")
+        raise
+
+    db_session.close()
+
+
 @cli.command()
 @click.pass_context
 @click.option('--age', type=int,
               help="Ignore files that were fixity checked more recently than this number of days")
-def fixity(context, age):
+@click.option('--worker', is_flag=True,
+              help="Lease batches of files from the database so that several processes can share the run; "
+                   "workers on several hosts need a database server URL rather than a SQLite file")
+@click.option('--batch-size', type=int, default=100, help="Number of files leased at a time in worker mode")
+@click.option('--lease-minutes', type=int, default=60,
+              help="Minutes after which files leased by an unresponsive worker are reclaimed")
+@click.option('--direct-io', is_flag=True, help="Read files with O_DIRECT, bypassing the page cache entirely")
+def fixity(context, age, worker, batch_size, lease_minutes, direct_io):
     """
     Perform a fixity check
     """
     """
-    Files are checked in order of the longest time since last fixity check.
+    Files that are due are checked in device and inode order, which keeps reads sequential.
     File objects that have a "fixity check" or "ingestion" event less than "age" days ago will not be checked.
     """
 
@@ -282,23 +391,39 @@ def fixity(context, age):
         age = int(context.obj["fixity_interval"])
     datetime_cutoff = datetime.now() - timedelta(days=age)
 
+    if worker:
+        name = worker_name()
+        logger.info("fixity worker %s started", name)
+        try:
+            run_worker(db_session, name, datetime_cutoff, batch_size, timedelta(minutes=lease_minutes), direct_io)
+        except:
+            db_session.close()
+            raise
+
+        db_session.close()
+        logger.info("completed fixity run")
+        return
+
+    due_objects = []
     for premis_object, last_checked in db_session.query(PremisObject, sqla.func.max(PremisEvent.eventDateTime)).\
             join(PremisEvent).\
             filter(sqla.or_(PremisEvent.eventType == "ingestion", PremisEvent.eventType == "fixity check")).\
-            filter(PremisObject.objectCategory == "file").\
+            filter(standalone_files()).\
             group_by(PremisObject.object_id).\
-            order_by(PremisEvent.eventDateTime).\
             all():
         if last_checked < datetime_cutoff:
-            try:
-                event = check_object_fixity(premis_object)
-                db_session.add(event)
-                db_session.commit()
-            except:
-                db_session.rollback()
-                db_session.close()
-                logger.error("got exception in fixity check of {}".format(premis_object.contentLocationValue))
-                raise
+            due_objects.append(premis_object)
+
+    for premis_object in physical_order(due_objects):
+        try:
+            event = check_object_fixity(premis_object, direct_io)
+            db_session.add(event)
+            db_session.commit()
+        except:
+            db_session.rollback()
+            db_session.close()
+            logger.error("got exception in fixity check of {}".format(premis_object.contentLocationValue))
+            raise
 
     db_session.close()
     logger.info("completed fixity run")
@@ -320,6 +445,34 @@ def report(context, outfile):
     click.echo("not yet implemented")  # TODO
 
 
+@cli.command(name="export-premis")
+@click.pass_context
+@click.argument('outfile', nargs=1)
+@click.option('--ingest', 'ingest_id', type=int, help="Only export the objects of this ingest")
+@click.option('--objects', 'object_range', type=(int, int), default=(None, None),
+              help="Only export objects whose internal IDs lie in this inclusive range, e.g. --objects 1 50000")
+@click.option('--gzip', 'compress', is_flag=True, help="Compress the output with gzip")
+@click.option('--batch-size', type=int, default=1000, help="Number of database rows read at a time")
+def export_premis(context, outfile, ingest_id, object_range, compress, batch_size):
+    """
+    Export preservation metadata as a PREMIS XML file
+    """
+
+    if not context.obj["has_config"]:
+        raise click.ClickException("Improper configuration detected. Run 'pyDPres configure' to set up.")
+
+    db_session = context.obj["db_session"]
+
+    if object_range == (None, None):
+        object_range = None
+
+    opener = gzip.open if compress or outfile.endswith(".gz") else open
+    with opener(outfile, "wb") as out:
+        export.export_premis(db_session, out, ingest_id, object_range, batch_size)
+
+    db_session.close()
+
+
 @cli.command()
 @click.pass_context
 def summary(context):
@@ -354,5 +507,45 @@ def delete(context, filepath):
     click.echo("not yet implemented")  # TODO
 
 
+@cli.command()
+@click.pass_context
+@click.argument('source', nargs=1)
+@click.argument('target', nargs=1)
+@click.option('--batch-size', type=int, default=5000, help="Number of rows to convert at a time")
+def migrate(context, source, target, batch_size):
+    """
+    Convert a version 0.1 database to the current format
+    """
+
+    if not os.path.isfile(source):
+        raise click.ClickException("{} does not exist.".format(source))
+    if not is_database_url(target) and os.path.exists(target):
+        raise click.ClickException("{} already exists. Choose a new file for the converted database.".format(target))
+
+    engine = sqla.create_engine(database_url(source))
+    Session.configure(bind=engine)
+    session = Session()
+    try:
+        db_version, = session.query(db_classes.PyDPresInfo.info_value).filter_by(info_name="version").one()
+    except (exc.OperationalError, exc.DatabaseError):
+        raise click.ClickException('{} is not a valid pyDPres database.'.format(source))
+    finally:
+        session.close()
+
+    if db_version != "0.1":
+        raise click.ClickException("{} is a version {} database and cannot be migrated.".format(source, db_version))
+
+    create_new_database(target)
+    try:
+        migration.migrate_database(source, target, batch_size)
+    except:
+        if not is_database_url(target):
+            os.remove(target)
+        raise
+
+    click.echo("\n{} has been converted to {}. To make it the default database, run 'pyDPres configure' and "
+               "enter {} as the default database.".format(source, target, target))
+
+
 if __name__ == "__main__":
     cli()
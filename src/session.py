@@ -6,3 +6,13 @@ Session = sessionmaker()
 class DuplicateIngestError(Exception):
     pass
 
+
+def is_database_url(database):
+    return "://" in str(database)
+
+
+def database_url(database):
+    """Return the SQLAlchemy URL for a database given either as a URL or as the path of a SQLite file"""
+    if is_database_url(database):
+        return str(database)
+    return "sqlite:///{}".format(database)
@@ -0,0 +1,291 @@
+"""Watch directories with Linux inotify and ingest or re-check files as soon as they change"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import db_classes
+import ingest
+import fixity
+from session import *
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct("iIII")
+QUERY_CHUNK_SIZE = 500  # stay well below SQLite's limit on bound parameters
+POLL_INTERVAL = 1.0  # longest wait between checks for a stop request
+
+WRITTEN = "written"
+DELETED = "deleted"
+
+
+class Inotify:
+    """Minimal ctypes binding for the inotify system calls"""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Return a list of (wd, mask, name) tuples, waiting at most `timeout` seconds for the first one"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 65536)
+        events = []
+        position = 0
+        while position < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, position)
+            position += EVENT_HEADER.size
+            name = os.fsdecode(data[position:position + length].rstrip(b"\0"))
+            position += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Ingest new files and record changes to tracked files under a set of directories.
+
+    Events are debounced per path: a path is only acted upon once it has been quiet for `debounce` seconds,
+    and then only according to its latest event. Every batch of settled paths is committed at once.
+
+    `stop` may be used as a signal handler: it only sets a flag, which is checked between batches, so a
+    batch is never cut short. A second stop request aborts the watch straight away, leaving the batch in hand
+    and any pending paths unprocessed.
+    """
+
+    def __init__(self, db_session, ingest_record, partition_type, identifier=None, debounce=2.0):
+        self.db_session = db_session
+        self.ingest_record = ingest_record
+        self.partition_type = partition_type
+        self.identifier = identifier
+        self.debounce = debounce
+
+        self.inotify = Inotify()
+        self.watches = {}
+        self.pending = {}
+        self.in_progress = {}
+        self.fixity_queue = []
+        self.stopping = False
+        self.aborting = False
+
+    def stop(self, signum=None, frame=None):
+        if self.stopping:
+            self.aborting = True
+            raise KeyboardInterrupt
+        self.stopping = True
+
+    def watch_tree(self, directory, queue_files=False):
+        logger = logging.getLogger(__name__)
+        for root, dirs, files in os.walk(directory):
+            try:
+                self.watches[self.inotify.add_watch(root, WATCH_MASK)] = root
+            except OSError as error:
+                logger.warning("cannot watch %s: %s", root, error)
+                continue
+            if queue_files:
+                # files created before the watch was in place would otherwise go unnoticed
+                for name in files:
+                    self.queue(os.path.join(root, name), WRITTEN)
+
+    def unwatch_tree(self, directory):
+        prefix = os.path.join(directory, "")
+        for wd, path in list(self.watches.items()):
+            if path == directory or path.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def queue(self, path, kind):
+        self.pending[path] = (time.monotonic(), kind)
+
+    def handle(self, wd, mask, name):
+        logger = logging.getLogger(__name__)
+
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify event queue overflowed; run 'pyDPres ingest' to pick up missed files")
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        path = os.path.join(directory, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch_tree(path, queue_files=True)
+            elif mask & IN_MOVED_FROM:
+                self.unwatch_tree(path)
+                for premis_object in self.tracked_under(path):
+                    self.queue(premis_object.contentLocationValue, DELETED)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self.queue(path, WRITTEN)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.queue(path, DELETED)
+
+    def tracked_under(self, directory):
+        PremisObject = db_classes.PremisObject
+        return self.db_session.query(PremisObject).\
+            filter(PremisObject.contentLocationValue.startswith(os.path.join(directory, ""), autoescape=True)).\
+            all()
+
+    def tracked(self, paths):
+        PremisObject = db_classes.PremisObject
+        found = {}
+        for start in range(0, len(paths), QUERY_CHUNK_SIZE):
+            chunk = paths[start:start + QUERY_CHUNK_SIZE]
+            for premis_object in self.db_session.query(PremisObject).\
+                    filter(PremisObject.contentLocationValue.in_(chunk)):
+                found[premis_object.contentLocationValue] = premis_object
+        return found
+
+    def settled(self, flush_all=False):
+        now = time.monotonic()
+        ready = {path: kind for path, (last_seen, kind) in self.pending.items()
+                 if flush_all or now - last_seen >= self.debounce}
+        for path in ready:
+            del self.pending[path]
+        return ready
+
+    def process(self, ready):
+        logger = logging.getLogger(__name__)
+        tracked = self.tracked(list(ready))
+
+        for path, kind in ready.items():
+            premis_object = tracked.get(path)
+            if premis_object is None:
+                if kind == WRITTEN and os.path.isfile(path) and not os.path.islink(path):
+                    ingest.ingest_file(Path(path), self.db_session, self.ingest_record, self.partition_type,
+                                       False, self.identifier)
+            elif premis_object.objectCategory == "file":
+                event_type = "modification" if kind == WRITTEN else "deletion"
+                logger.info("%s: %s", event_type, path)
+                event = db_classes.PremisEvent(
+                    eventIdentifierType="UUID",
+                    eventIdentifierValue=str(uuid.uuid4()),
+                    eventType=event_type,
+                    eventDateTime=datetime.now(),
+                    eventDetail="program=pyDPres watch"
+                )
+                event.premis_object = premis_object
+                self.db_session.add(event)
+                self.fixity_queue.append(premis_object)
+
+        self.ingest_record.ingest_end_time = datetime.now()
+        self.db_session.commit()
+
+    def commit_batch(self, ready):
+        logger = logging.getLogger(__name__)
+        self.in_progress = dict(ready)
+        try:
+            self.process(ready)
+            self.in_progress = {}
+            return
+        except Exception as error:
+            # e.g. a file was ingested by another process or vanished meanwhile
+            logger.debug("batch of %d files failed (%s); retrying one file at a time", len(ready), error)
+            self.db_session.rollback()
+            self.fixity_queue = []
+
+        # one file at a time, so that a single bad file does not hold up the others
+        for path, kind in ready.items():
+            try:
+                self.process({path: kind})
+            except DuplicateIngestError:
+                logger.warning('%s already ingested', path)
+                self.db_session.rollback()
+            except FileNotFoundError:
+                logger.warning('%s disappeared before it could be ingested', path)
+                self.db_session.rollback()
+            except Exception:
+                logger.exception('could not process %s', path)
+                self.db_session.rollback()
+            del self.in_progress[path]
+
+    def check_queued(self):
+        while self.fixity_queue:
+            # only dequeued once the event is committed, so an interrupted check is redone
+            premis_object = self.fixity_queue[0]
+            event = fixity.check_object_fixity(premis_object)
+            self.db_session.add(event)
+            self.db_session.commit()
+            self.fixity_queue.pop(0)
+
+    def abandon_batch(self):
+        """Roll back an interrupted batch and queue its uncommitted paths again"""
+        self.db_session.rollback()
+        for path, kind in self.in_progress.items():
+            self.pending.setdefault(path, (time.monotonic(), kind))
+        self.in_progress = {}
+
+    def run(self, paths):
+        logger = logging.getLogger(__name__)
+        for path in paths:
+            self.watch_tree(os.fspath(Path(path).resolve()))
+        logger.info("watching %d directories", len(self.watches))
+
+        try:
+            while not self.stopping:
+                try:
+                    timeout = min(self.debounce, POLL_INTERVAL) if self.pending else POLL_INTERVAL
+                    for wd, mask, name in self.inotify.read(timeout):
+                        self.handle(wd, mask, name)
+                    ready = self.settled()
+                    if ready:
+                        self.commit_batch(ready)
+                        self.check_queued()
+                except KeyboardInterrupt:
+                    # a second stop request, or Ctrl-C without a stop handler installed
+                    self.stopping = True
+                    self.abandon_batch()
+
+            if self.aborting:
+                logger.warning("watch aborted; %d pending files were not processed", len(self.pending))
+                return
+
+            logger.info("stopping watch")
+            self.db_session.rollback()
+            ready = self.settled(flush_all=True)
+            if ready:
+                self.commit_batch(ready)
+            self.check_queued()
+        finally:
+            self.inotify.close()
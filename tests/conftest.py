@@ -0,0 +1,31 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+import sqlalchemy as sqla
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+import db_classes
+from session import Session
+
+
+@pytest.fixture
+def db_session(tmp_path):
+    """A session on an empty database of the current version"""
+    engine = sqla.create_engine("sqlite:///{}".format(tmp_path / "pyDPres.sqlite"))
+    db_classes.Base.metadata.create_all(engine)
+    Session.configure(bind=engine)
+    session = Session()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def ingest_record(db_session):
+    record = db_classes.PyDPresIngest(ingest_start_time=datetime.now(), ingest_note="test")
+    db_session.add(record)
+    db_session.commit()
+    return record
@@ -0,0 +1,167 @@
+import io
+import tarfile
+import warnings
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import container
+import db_classes
+import fixity
+import ingest
+import pronom
+
+SIGNATURES = """<?xml version="1.0" encoding="UTF-8"?>
+<FFSignatureFile xmlns="http://www.nationalarchives.gov.uk/pronom/SignatureFile" Version="1">
+<InternalSignatureCollection>
+<InternalSignature ID="1"><ByteSequence Reference="BOFoffset">
+ <SubSequence Position="1" SubSeqMinOffset="0" SubSeqMaxOffset="0"><Sequence>504B0304</Sequence></SubSequence>
+</ByteSequence></InternalSignature>
+<InternalSignature ID="2"><ByteSequence Reference="BOFoffset">
+ <SubSequence Position="1" SubSeqMinOffset="0" SubSeqMaxOffset="0"><Sequence>1F8B08</Sequence></SubSequence>
+</ByteSequence></InternalSignature>
+</InternalSignatureCollection>
+<FileFormatCollection>
+<FileFormat ID="1" Name="ZIP Format" PUID="x-fmt/263"><InternalSignatureID>1</InternalSignatureID>
+ <Extension>zip</Extension></FileFormat>
+<FileFormat ID="2" Name="GZIP Format" PUID="x-fmt/266"><InternalSignatureID>2</InternalSignatureID>
+ <Extension>gz</Extension></FileFormat>
+<FileFormat ID="3" Name="Plain Text File" PUID="x-fmt/111"><Extension>txt</Extension></FileFormat>
+</FileFormatCollection>
+</FFSignatureFile>
+"""
+
+MEMBERS = {"a.txt": b"alpha\n", "d/b.bin": bytes(range(256)) * 64, "c.txt": b"gamma\n"}
+
+
+@pytest.fixture
+def identifier(tmp_path):
+    path = tmp_path / "signatures.xml"
+    path.write_text(SIGNATURES)
+    return pronom.SignatureIndex(path)
+
+
+def write_zip(path, members, duplicate=None):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("d/", b"")
+        for name, content in members.items():
+            archive.writestr(name, content)
+        if duplicate is not None:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # zipfile warns about the duplicate name
+                archive.writestr(*duplicate)
+
+
+def write_tar_gz(path, members):
+    source = path.parent / "tar-source"
+    with tarfile.open(path, "w:gz") as archive:
+        for name, content in members.items():
+            member_path = source / name
+            member_path.parent.mkdir(parents=True, exist_ok=True)
+            member_path.write_bytes(content)
+            archive.add(member_path, arcname=name)
+
+
+def ingest_container(path, db_session, ingest_record, identifier):
+    ingest.ingest_file(Path(path), db_session, ingest_record, "NTFS", False, identifier)
+    db_session.commit()
+    return db_session.query(db_classes.PremisObject).filter_by(contentLocationValue=str(path)).one()
+
+
+def check(container_object, db_session):
+    event = fixity.check_object_fixity(container_object)
+    db_session.add(event)
+    db_session.commit()
+    return event
+
+
+def member_outcomes(container_object):
+    """The latest fixity check outcome and detail of each member, by member name"""
+    outcomes = {}
+    for member in container_object.related_objects:
+        checks = [e for e in member.events if e.eventType == "fixity check"]
+        name = member.contentLocationValue.split("!", 1)[1]
+        outcomes[name] = (checks[-1].eventOutcome, checks[-1].eventDetail) if checks else None
+    return outcomes
+
+
+@pytest.mark.parametrize("name, write", [("archive.zip", write_zip), ("archive.tar.gz", write_tar_gz)])
+def test_members_are_ingested_in_place(tmp_path, db_session, ingest_record, identifier, name, write):
+    path = tmp_path / name
+    write(path, MEMBERS)
+
+    container_object = ingest_container(path, db_session, ingest_record, identifier)
+
+    assert container_object.relationshipSubType == "has Part"
+    members = {member.contentLocationValue: member for member in container_object.related_objects}
+    assert set(members) == {"{}!{}".format(path, member_name) for member_name in MEMBERS}
+    for member_name, content in MEMBERS.items():
+        member = members["{}!{}".format(path, member_name)]
+        assert member.contentLocationType == container.MEMBER_LOCATION_TYPE
+        assert member.relationshipSubType == "is Part Of"
+        assert member.file_size == len(content)
+        assert member.messageDigest == container.digest_stream(io.BytesIO(content))[0]
+        assert member.originalName == member_name.rsplit("/", 1)[-1]
+    assert members["{}!a.txt".format(path)].formatRegistryKey == "x-fmt/111"
+
+    # members are checked through their container, never on their own
+    standalone = db_session.query(db_classes.PremisObject).filter(fixity.standalone_files()).all()
+    assert standalone == [container_object]
+
+
+def test_duplicate_member_names_keep_the_first(tmp_path, db_session, ingest_record, identifier):
+    path = tmp_path / "archive.zip"
+    write_zip(path, MEMBERS, duplicate=("a.txt", b"second copy\n"))
+
+    container_object = ingest_container(path, db_session, ingest_record, identifier)
+
+    duplicates = [m for m in container_object.related_objects if m.contentLocationValue.endswith("!a.txt")]
+    assert len(duplicates) == 1
+    assert duplicates[0].file_size == len(MEMBERS["a.txt"])
+
+    check(container_object, db_session)
+    assert member_outcomes(container_object)["a.txt"] == ("OK", "verified through container digest")
+
+
+@pytest.mark.parametrize("name, write", [("archive.zip", write_zip), ("archive.tar.gz", write_tar_gz)])
+def test_members_verified_through_unchanged_container(tmp_path, db_session, ingest_record, identifier, name,
+                                                      write):
+    path = tmp_path / name
+    write(path, MEMBERS)
+    container_object = ingest_container(path, db_session, ingest_record, identifier)
+
+    assert check(container_object, db_session).eventOutcome == "OK"
+
+    assert member_outcomes(container_object) == {
+        member_name: ("OK", "verified through container digest") for member_name in MEMBERS}
+
+
+@pytest.mark.parametrize("name, write", [("archive.zip", write_zip), ("archive.tar.gz", write_tar_gz)])
+def test_changed_container_checks_each_member(tmp_path, db_session, ingest_record, identifier, name, write):
+    path = tmp_path / name
+    write(path, MEMBERS)
+    container_object = ingest_container(path, db_session, ingest_record, identifier)
+
+    changed = {"a.txt": b"ALPHA\n", "d/b.bin": MEMBERS["d/b.bin"], "new.txt": b"not ingested\n"}
+    path.unlink()
+    write(path, changed)
+
+    assert check(container_object, db_session).eventOutcome == "Failed"
+
+    assert member_outcomes(container_object) == {
+        "a.txt": ("Failed", "verified in place within container"),
+        "d/b.bin": ("OK", "verified in place within container"),
+        "c.txt": ("Missing", "verified in place within container"),
+    }
+
+
+def test_unreadable_container_fails_unread_members(tmp_path, db_session, ingest_record, identifier):
+    path = tmp_path / "archive.tar.gz"
+    write_tar_gz(path, MEMBERS)
+    container_object = ingest_container(path, db_session, ingest_record, identifier)
+
+    path.write_bytes(path.read_bytes()[:40])
+
+    assert check(container_object, db_session).eventOutcome == "Failed"
+    assert {outcome for outcome, _ in member_outcomes(container_object).values()} == {"Failed"}
@@ -0,0 +1,133 @@
+import io
+import uuid
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+
+import pytest
+
+import db_classes
+import export
+
+PREMIS = "{%s}" % export.PREMIS_NAMESPACE
+
+
+def premis_object(ingest, category="file", **columns):
+    return db_classes.PremisObject(
+        objectIdentifierType="UUID",
+        objectIdentifierValue=str(uuid.uuid4()),
+        objectCategory=category,
+        messageDigestAlgorithm="SHA256" if category == "file" else "MD5",
+        messageDigest="00" * (32 if category == "file" else 16),
+        ingest=ingest,
+        **columns
+    )
+
+
+def premis_event(event_type, premis_object, agent=None):
+    event = db_classes.PremisEvent(
+        eventIdentifierType="UUID",
+        eventIdentifierValue=str(uuid.uuid4()),
+        eventType=event_type,
+        eventDateTime=datetime(2020, 1, 2, 3, 4, 5),
+        agent_id=None if agent is None else agent.agent_id
+    )
+    premis_object.events.append(event)
+    return event
+
+
+@pytest.fixture
+def database(db_session, ingest_record):
+    """Two ingests: a WAVE file with a bitstream and a property, and a plain file"""
+    agent = db_classes.PremisAgent(agentIdentifierType="URI", agentIdentifierValue="https://example.org/fido",
+                                   agentName="fido", agentType="software", agentVersion="1.4")
+    second_ingest = db_classes.PyDPresIngest(ingest_start_time=datetime.now(), ingest_note="second")
+    db_session.add_all([agent, second_ingest])
+    db_session.flush()
+
+    wave = premis_object(ingest_record, contentLocationValue="/data/a.wav", file_size=1000,
+                         formatName="Waveform Audio", formatRegistryName="PRONOM", formatRegistryKey="fmt/141",
+                         relationshipType="structural", relationshipSubType="has Part")
+    wave.properties = [db_classes.PremisSignificantProperties(significantPropertiesType="channels",
+                                                              significantPropertiesValue="2")]
+    db_session.add(wave)
+    db_session.flush()
+    # bitstreams carry no ingest of their own
+    bitstream = premis_object(None, category="bitstream", relationshipType="structural",
+                              relationshipSubType="is Part Of", relatedObject_id=wave.object_id)
+    plain = premis_object(second_ingest, contentLocationValue="/data/b.txt", file_size=5)
+    db_session.add_all([bitstream, plain])
+    db_session.flush()
+
+    premis_event("ingestion", wave)
+    premis_event("format identification", wave, agent)
+    premis_event("message digest calculation", bitstream)
+    premis_event("ingestion", plain)
+    db_session.commit()
+    return dict(wave=wave, bitstream=bitstream, plain=plain, agent=agent, first_ingest=ingest_record.ingest_id)
+
+
+def identifiers(objects):
+    return {name: (premis.object_id, premis.objectIdentifierValue) for name, premis in objects.items()
+            if isinstance(premis, db_classes.PremisObject)}
+
+
+def export_document(db_session, **partition):
+    out = io.BytesIO()
+    export.export_premis(db_session, out, batch_size=2, **partition)
+    return ElementTree.fromstring(out.getvalue())
+
+
+def object_identifier(element):
+    return element.find("{0}objectIdentifier/{0}objectIdentifierValue".format(PREMIS)).text
+
+
+def event_object(element):
+    return element.find("{0}linkingObjectIdentifier/{0}linkingObjectIdentifierValue".format(PREMIS)).text
+
+
+def test_full_export(db_session, database):
+    ids = identifiers(database)
+    root = export_document(db_session)
+
+    kinds = [element.tag.replace(PREMIS, "") for element in root]
+    assert kinds == ["object"] * 3 + ["event"] * 4 + ["agent"]
+
+    objects = {object_identifier(element): element for element in root.findall(PREMIS + "object")}
+    wave_value, bitstream_value, plain_value = (ids[name][1] for name in ("wave", "bitstream", "plain"))
+    assert set(objects) == {wave_value, bitstream_value, plain_value}
+
+    def related(value):
+        return [e.text for e in objects[value].iter(PREMIS + "relatedObjectIdentifierValue")]
+
+    assert related(wave_value) == [bitstream_value]
+    assert related(bitstream_value) == [wave_value]
+    assert related(plain_value) == []
+    assert objects[wave_value].find("{0}significantProperties/{0}significantPropertiesValue".format(PREMIS)).text \
+        == "2"
+    assert objects[bitstream_value].get("{http://www.w3.org/2001/XMLSchema-instance}type") == "premis:bitstream"
+
+    events = root.findall(PREMIS + "event")
+    assert sorted(event_object(e) for e in events) == sorted([wave_value, wave_value, bitstream_value, plain_value])
+    agent_links = [e.find("{0}linkingAgentIdentifier/{0}linkingAgentIdentifierValue".format(PREMIS))
+                   for e in events]
+    assert [link.text for link in agent_links if link is not None] == ["https://example.org/fido"]
+
+
+def test_ingest_partition_includes_bitstreams(db_session, database):
+    ids = identifiers(database)
+    root = export_document(db_session, ingest_id=database["first_ingest"])
+
+    exported = {object_identifier(element) for element in root.findall(PREMIS + "object")}
+    assert exported == {ids["wave"][1], ids["bitstream"][1]}
+    assert {event_object(e) for e in root.findall(PREMIS + "event")} == {ids["wave"][1], ids["bitstream"][1]}
+    # agents are always exported in full
+    assert len(root.findall(PREMIS + "agent")) == 1
+
+
+def test_object_range_partition(db_session, database):
+    ids = identifiers(database)
+    plain_id, plain_value = ids["plain"]
+    root = export_document(db_session, object_range=(plain_id, plain_id))
+
+    assert [object_identifier(element) for element in root.findall(PREMIS + "object")] == [plain_value]
+    assert [event_object(e) for e in root.findall(PREMIS + "event")] == [plain_value]
@@ -0,0 +1,89 @@
+import hashlib
+import multiprocessing
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as sqla
+
+import db_classes
+import fixity
+from session import Session
+
+FILE_COUNT = 60
+WORKER_COUNT = 4
+
+
+def make_database(tmp_path):
+    database = tmp_path / "pyDPres.sqlite"
+    engine = sqla.create_engine("sqlite:///{}".format(database))
+    db_classes.Base.metadata.create_all(engine)
+    Session.configure(bind=engine)
+    session = Session()
+
+    ingested = datetime.now() - timedelta(days=30)
+    for i in range(FILE_COUNT):
+        path = tmp_path / "file{}.bin".format(i)
+        content = os.urandom(4096 + i)
+        path.write_bytes(content)
+        premis_object = db_classes.PremisObject(
+            objectIdentifierType="UUID",
+            objectIdentifierValue=str(uuid.uuid4()),
+            objectCategory="file",
+            messageDigestAlgorithm="SHA256",
+            messageDigest=hashlib.sha256(content).hexdigest(),
+            contentLocationValue=str(path)
+        )
+        premis_object.events = [db_classes.PremisEvent(
+            eventIdentifierType="UUID",
+            eventIdentifierValue=str(uuid.uuid4()),
+            eventType="ingestion",
+            eventDateTime=ingested
+        )]
+        session.add(premis_object)
+    session.commit()
+    session.close()
+    engine.dispose()
+    return database
+
+
+def work(database, batch_size, lease_seconds):
+    engine = sqla.create_engine("sqlite:///{}".format(database), connect_args={"timeout": 60})
+    Session.configure(bind=engine)
+    session = Session()
+    fixity.run_worker(session, fixity.worker_name(), datetime.now(), batch_size, timedelta(seconds=lease_seconds))
+    session.close()
+
+
+@pytest.mark.parametrize("batch_size, lease_seconds", [(5, 600), (20, 0.01)])
+def test_each_due_object_is_checked_exactly_once(tmp_path, batch_size, lease_seconds):
+    database = make_database(tmp_path)
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=work, args=(database, batch_size, lease_seconds))
+               for _ in range(WORKER_COUNT)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=120)
+        assert worker.exitcode == 0
+
+    engine = sqla.create_engine("sqlite:///{}".format(database))
+    Session.configure(bind=engine)
+    session = Session()
+    PremisObject = db_classes.PremisObject
+    PremisEvent = db_classes.PremisEvent
+    fixity_events = dict(session.query(PremisObject.object_id, sqla.func.count(PremisEvent.event_id)).
+                         outerjoin(PremisEvent, sqla.and_(PremisEvent.object_id == PremisObject.object_id,
+                                                          PremisEvent.eventType == "fixity check")).
+                         group_by(PremisObject.object_id))
+    outcomes = {outcome for outcome, in session.query(PremisEvent.eventOutcome).
+                filter(PremisEvent.eventType == "fixity check")}
+    leased = session.query(PremisObject).filter(PremisObject.lease_owner.isnot(None)).count()
+    session.close()
+
+    assert len(fixity_events) == FILE_COUNT
+    assert set(fixity_events.values()) == {1}
+    assert outcomes == {"OK"}
+    assert leased == 0
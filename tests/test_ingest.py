@@ -0,0 +1,34 @@
+import hashlib
+import os
+
+import pytest
+
+import ingest
+
+# around the 4 KiB block size and the 4 MiB read buffer, none of them block aligned except 4096
+SIZES = [0, 1, 511, 4095, 4096, 4097, 4194303, 4194305, 3 * 4194304 + 123]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("direct_io", [False, True])
+def test_digest_matches_hashlib(tmp_path, size, direct_io):
+    content = os.urandom(size)
+    path = tmp_path / "file.bin"
+    path.write_bytes(content)
+
+    assert ingest.calculate_sha256(path, direct_io) == hashlib.sha256(content).hexdigest()
+
+
+@pytest.mark.parametrize("size", [0, 4097, 4194305])
+def test_digest_without_readv(tmp_path, monkeypatch, size):
+    content = os.urandom(size)
+    path = tmp_path / "file.bin"
+    path.write_bytes(content)
+    expected = ingest.calculate_sha256(path)
+
+    monkeypatch.delattr(os, "readv")
+    monkeypatch.delattr(os, "posix_fadvise", raising=False)
+    monkeypatch.delattr(os, "O_DIRECT", raising=False)
+
+    assert ingest.calculate_sha256(path) == expected == hashlib.sha256(content).hexdigest()
+    assert ingest.calculate_sha256(path, direct_io=True) == expected
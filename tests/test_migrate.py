@@ -0,0 +1,96 @@
+import configparser
+from datetime import datetime
+
+import sqlalchemy as sqla
+from click.testing import CliRunner
+
+import db_classes
+import migrate
+import pyDPres
+from session import Session
+
+DIGEST = "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+OBJECT_UUID = "6f1d5d1e-4a43-4b7a-9c1a-3f6b1c2d9e01"
+EVENT_UUID = "0b7e2f44-8c55-4d3e-a1f2-7e9d6c5b4a32"
+INGESTED = datetime(2019, 5, 17, 13, 45, 12, 345678)
+FILE_SIZE = 5 * 2 ** 32 + 7  # too large for a 32-bit integer
+
+
+def make_legacy_database(path):
+    engine = sqla.create_engine("sqlite:///{}".format(path))
+    migrate.legacy_metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(migrate.legacy_ingest.insert(), [dict(
+            ingest_id=1, ingest_start_time=INGESTED, ingest_end_time=INGESTED, ingest_note="legacy")])
+        connection.execute(migrate.legacy_object.insert(), [dict(
+            object_id=1, objectIdentifierType="UUID", objectIdentifierValue=OBJECT_UUID, objectCategory="file",
+            messageDigestAlgorithm="SHA256", messageDigest=DIGEST, file_size=str(FILE_SIZE),
+            formatName="Waveform Audio", formatRegistryName="PRONOM", formatRegistryKey="fmt/141",
+            contentLocationType="filesystem path", contentLocationValue="/data/a.wav", ingest_id=1)])
+        connection.execute(migrate.legacy_event.insert(), [dict(
+            event_id=1, eventIdentifierType="UUID", eventIdentifierValue=EVENT_UUID, eventType="fixity check",
+            eventDateTime=INGESTED, eventOutcome="Failed", object_id=1)])
+        connection.execute(migrate.legacy_info.insert(), [dict(info_id=1, info_name="version", info_value="0.1")])
+    engine.dispose()
+
+
+def test_migrated_values_read_back_unchanged(tmp_path):
+    source = tmp_path / "old.sqlite"
+    target = tmp_path / "new.sqlite"
+    make_legacy_database(source)
+    pyDPres.create_new_database(target)
+
+    migrate.migrate_database(source, target)
+
+    engine = sqla.create_engine("sqlite:///{}".format(target))
+    Session.configure(bind=engine)
+    session = Session()
+    premis_object = session.query(db_classes.PremisObject).one()
+    event = session.query(db_classes.PremisEvent).one()
+    ingest = session.query(db_classes.PyDPresIngest).one()
+    version, = session.query(db_classes.PyDPresInfo.info_value).filter_by(info_name="version").one()
+
+    assert premis_object.messageDigest == DIGEST
+    assert premis_object.objectIdentifierValue == OBJECT_UUID
+    assert premis_object.objectCategory == "file"
+    assert premis_object.messageDigestAlgorithm == "SHA256"
+    assert premis_object.file_size == FILE_SIZE
+    assert event.eventIdentifierValue == EVENT_UUID
+    assert event.eventType == "fixity check"
+    assert event.eventOutcome == "Failed"
+    assert event.eventDateTime == INGESTED
+    assert event.premis_object is premis_object
+    assert ingest.ingest_start_time == INGESTED
+    assert version == pyDPres.DB_VERSION
+    session.close()
+    engine.dispose()
+
+
+def test_configure_accepts_migrated_database(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    runner = CliRunner()
+    source = tmp_path / "old.sqlite"
+    target = tmp_path / "new.sqlite"
+
+    result = runner.invoke(pyDPres.cli, ["--quiet", "configure"], input="{}\nn\n7\nNTFS\n\n".format(source))
+    assert result.exit_code == 0, result.output
+    # the configured default is now replaced by a version 0.1 database
+    source.unlink()
+    make_legacy_database(source)
+
+    result = runner.invoke(pyDPres.cli, ["--quiet", "summary"])
+    assert result.exit_code != 0
+    assert "pyDPres migrate" in result.output
+
+    result = runner.invoke(pyDPres.cli, ["--quiet", "migrate", str(source), str(target)])
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(pyDPres.cli, ["--quiet", "configure"], input="y\n{}\nn\n7\nNTFS\n\n".format(target))
+    assert result.exit_code == 0, result.output
+    config = configparser.ConfigParser()
+    config.read(tmp_path / "data" / "pyDPres" / "pyDPres-config.ini")
+    assert config["DEFAULT"]["DEFAULT_DB"] == str(target)
+
+    result = runner.invoke(pyDPres.cli, ["--quiet", "summary"])
+    assert result.exit_code == 0, result.output
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+import pronom
+
+SIGNATURES = """<?xml version="1.0" encoding="UTF-8"?>
+<FFSignatureFile xmlns="http://www.nationalarchives.gov.uk/pronom/SignatureFile" Version="42">
+<InternalSignatureCollection>
+<InternalSignature ID="1">
+ <ByteSequence Reference="BOFoffset"><SubSequence Position="1" SubSeqMinOffset="0" SubSeqMaxOffset="0">
+  <Sequence>52494646{4}57415645</Sequence></SubSequence></ByteSequence>
+</InternalSignature>
+<InternalSignature ID="2">
+ <ByteSequence Reference="BOFoffset"><SubSequence Position="1" SubSeqMinOffset="257" SubSeqMaxOffset="257">
+  <Sequence>7573746172</Sequence></SubSequence></ByteSequence>
+</InternalSignature>
+<InternalSignature ID="3">
+ <ByteSequence Reference="BOFoffset"><SubSequence Position="1" SubSeqMinOffset="0" SubSeqMaxOffset="0">
+  <Sequence>255044462D312E</Sequence>
+  <RightFragment Position="1" MinOffset="0" MaxOffset="0">[30:37]</RightFragment></SubSequence></ByteSequence>
+ <ByteSequence Reference="EOFoffset"><SubSequence Position="1" SubSeqMinOffset="0" SubSeqMaxOffset="1024">
+  <Sequence>2525454F46</Sequence></SubSequence></ByteSequence>
+</InternalSignature>
+<InternalSignature ID="4">
+ <ByteSequence Reference="Variable"><SubSequence Position="1" SubSeqMinOffset="0">
+  <Sequence>(6869|4849)??7468657265</Sequence></SubSequence></ByteSequence>
+</InternalSignature>
+<InternalSignature ID="5">
+ <ByteSequence Reference="EOFoffset"><SubSequence Position="1" SubSeqMinOffset="2" SubSeqMaxOffset="2">
+  <Sequence>454E44</Sequence></SubSequence></ByteSequence>
+</InternalSignature>
+<InternalSignature ID="6">
+ <ByteSequence Reference="BOFoffset"><SubSequence Position="1" SubSeqMinOffset="8" SubSeqMaxOffset="4">
+  <Sequence>434C414D50</Sequence></SubSequence></ByteSequence>
+</InternalSignature>
+</InternalSignatureCollection>
+<FileFormatCollection>
+<FileFormat ID="10" Name="Waveform Audio" PUID="fmt/6"><InternalSignatureID>1</InternalSignatureID>
+ <Extension>wav</Extension></FileFormat>
+<FileFormat ID="11" Name="Tape Archive Format" PUID="x-fmt/265"><InternalSignatureID>2</InternalSignatureID>
+ <Extension>tar</Extension></FileFormat>
+<FileFormat ID="12" Name="PDF 1.4" PUID="fmt/18"><InternalSignatureID>3</InternalSignatureID>
+ <Extension>pdf</Extension><HasPriorityOverFileFormatID>13</HasPriorityOverFileFormatID></FileFormat>
+<FileFormat ID="13" Name="Greeting" PUID="x-fmt/1"><InternalSignatureID>4</InternalSignatureID>
+ <Extension>txt</Extension></FileFormat>
+<FileFormat ID="14" Name="Trailer" PUID="x-fmt/2"><InternalSignatureID>5</InternalSignatureID></FileFormat>
+<FileFormat ID="15" Name="Clamped" PUID="x-fmt/3"><InternalSignatureID>6</InternalSignatureID></FileFormat>
+<FileFormat ID="16" Name="Extension Only" PUID="x-fmt/4"><Extension>xyz</Extension></FileFormat>
+</FileFormatCollection>
+</FFSignatureFile>
+"""
+
+
+@pytest.fixture
+def signature_file(tmp_path):
+    path = tmp_path / "signatures.xml"
+    path.write_text(SIGNATURES)
+    return path
+
+
+@pytest.fixture
+def index(signature_file):
+    return pronom.SignatureIndex(signature_file)
+
+
+def identify(index, tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return index.identify(path)
+
+
+def test_bof_signature(index, tmp_path):
+    content = b"RIFF\x24\x08\x00\x00WAVEfmt " + bytes(100)
+    assert identify(index, tmp_path, "sound.bin", content) == ("fmt/6", "Waveform Audio", "signature")
+
+
+def test_bof_signature_at_fixed_offset_is_keyed(index, tmp_path):
+    header = b"file.txt".ljust(257, b"\0") + b"ustar\x0000"
+    assert identify(index, tmp_path, "archive.bin", header.ljust(1024, b"\0")) == \
+        ("x-fmt/265", "Tape Archive Format", "signature")
+
+    # keyed on the bytes at offset 257, not scanned for anywhere in the window
+    assert all(signature_id != "2" for _, signature_id in index.literals)
+    assert "2" not in index.candidates(b"ustar" + bytes(1000), b"ustar" + bytes(1000))
+    assert identify(index, tmp_path, "other.bin", b"ustar".rjust(1024, b"\0")) is None
+
+
+def test_eof_signature_at_fixed_offset(index, tmp_path):
+    assert identify(index, tmp_path, "log.bin", bytes(50) + b"END\r\n") == ("x-fmt/2", "Trailer", "signature")
+    assert identify(index, tmp_path, "log2.bin", bytes(50) + b"END\r\n\r\n") is None
+
+
+def test_eof_signature_in_tail_window(index, tmp_path):
+    content = b"%PDF-1.4\n" + os.urandom(pronom.WINDOW_SIZE * 2) + b"\n%%EOF\n"
+    assert identify(index, tmp_path, "doc.bin", content) == ("fmt/18", "PDF 1.4", "signature")
+
+
+def test_variable_signature(index, tmp_path):
+    content = bytes(3000) + b"hi there" + bytes(10)
+    assert identify(index, tmp_path, "note.bin", content) == ("x-fmt/1", "Greeting", "signature")
+
+
+def test_priority_over_resolves_multiple_matches(index, tmp_path):
+    content = b"%PDF-1.4\nHi there\n%%EOF\n"
+    assert identify(index, tmp_path, "both.txt", content) == ("fmt/18", "PDF 1.4", "signature")
+
+
+def test_offset_with_maximum_below_minimum_is_clamped(index, tmp_path):
+    assert "6" in index.signatures
+    assert identify(index, tmp_path, "clamp.bin", b"12345678CLAMP") == ("x-fmt/3", "Clamped", "signature")
+
+
+def test_extension_fallback(index, tmp_path):
+    assert identify(index, tmp_path, "data.xyz", b"nothing to see") == ("x-fmt/4", "Extension Only", "extension")
+    assert identify(index, tmp_path, "data.abc", b"nothing to see") is None
+
+
+def test_cache_is_rebuilt_when_signature_file_changes(signature_file, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    builds = []
+    build = pronom.SignatureIndex.__init__
+
+    def counting_build(self, signature_file):
+        builds.append(signature_file)
+        build(self, signature_file)
+
+    monkeypatch.setattr(pronom.SignatureIndex, "__init__", counting_build)
+
+    first = pronom.SignatureIndex.load(signature_file, cache_dir)
+    second = pronom.SignatureIndex.load(signature_file, cache_dir)
+    assert len(builds) == 1
+    assert second.version == first.version == "42"
+
+    signature_file.write_text(SIGNATURES.replace('Version="42"', 'Version="43"'))
+    stat = os.stat(signature_file)
+    os.utime(signature_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    third = pronom.SignatureIndex.load(signature_file, cache_dir)
+    assert len(builds) == 2
+    assert third.version == "43"
@@ -0,0 +1,58 @@
+import watch
+
+
+def make_watcher(db_session, ingest_record, paths):
+    watcher = watch.Watcher(db_session, ingest_record, "NTFS", debounce=0)
+    for path in paths:
+        watcher.pending[path] = (0, watch.WRITTEN)
+    return watcher
+
+
+def test_stop_finishes_the_batch_in_hand_and_flushes(tmp_path, db_session, ingest_record):
+    watcher = make_watcher(db_session, ingest_record, [str(tmp_path / "a")])
+    calls = []
+
+    def process(ready):
+        calls.append(dict(ready))
+        if len(calls) == 1:
+            watcher.stop()
+            watcher.queue(str(tmp_path / "b"), watch.WRITTEN)
+
+    watcher.process = process
+    watcher.run([tmp_path])
+
+    assert calls == [{str(tmp_path / "a"): watch.WRITTEN}, {str(tmp_path / "b"): watch.WRITTEN}]
+
+
+def test_second_stop_aborts_without_reprocessing_the_batch(tmp_path, db_session, ingest_record):
+    watcher = make_watcher(db_session, ingest_record, [str(tmp_path / "a"), str(tmp_path / "b")])
+    calls = []
+
+    def process(ready):
+        calls.append(dict(ready))
+        watcher.stop()
+        watcher.stop()
+
+    watcher.process = process
+    watcher.run([tmp_path])
+
+    assert len(calls) == 1
+    assert watcher.aborting
+    assert set(watcher.pending) == {str(tmp_path / "a"), str(tmp_path / "b")}
+
+
+def test_a_failing_file_is_skipped(tmp_path, db_session, ingest_record):
+    paths = [str(tmp_path / name) for name in "abc"]
+    watcher = make_watcher(db_session, ingest_record, [])
+    done = []
+
+    def process(ready):
+        if str(tmp_path / "b") in ready:
+            raise ValueError("unreadable")
+        done.extend(ready)
+
+    watcher.process = process
+    watcher.commit_batch({path: watch.WRITTEN for path in paths})
+
+    assert done == [paths[0], paths[2]]
+    assert watcher.in_progress == {}